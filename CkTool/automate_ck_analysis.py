@@ -1,10 +1,18 @@
 import subprocess
 import os
+import sys
 import json
 import shutil
-from git import Repo
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from fetch_repos import fetch_and_clone_repositories  # Import the new function to fetch repos
+from fetch_repos import stream_cloned_repositories  # Import the new function to fetch repos
+from ck_results import convert_ck_csv
+
+# The mirror store lives at the root of the project, next to clonning_repo.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from mirror_store import Mirror_Store
 
 
 # Paths to CK jar and where to store repositories and outputs
@@ -14,6 +22,12 @@ output_data_folder = "./saved_metrics_data/"  # Folder to save JSON output metri
 
 # Path to track failed or skipped repositories
 failed_repos_file = "failed_repos.json"  # This will store the URLs of failed repositories
+failed_repos_lock = threading.Lock()
+
+# CK heap: a base plus a share per MB of Java source, between these bounds (in MB)
+min_ck_heap = 1024
+max_ck_heap = 8192
+ck_heap_per_source_mb = 64
 
 # Create necessary folders if they don’t exist
 Path(repos_folder).mkdir(parents=True, exist_ok=True)
@@ -22,137 +36,181 @@ Path(output_data_folder).mkdir(parents=True, exist_ok=True)
 # the repos that are not consisent with .jar dependencies will not be analyzed and moved to failed_repos.json
 def log_failed_repo(repo_url, reason):
     """Logs the failed or skipped repository URL and the reason."""
-    failed_repos = []
-    
-    if os.path.exists(failed_repos_file):
-        with open(failed_repos_file, "r") as f:
-            failed_repos = json.load(f)
-
-    failed_repos.append({"repo_url": repo_url, "reason": reason})
-    
-    with open(failed_repos_file, "w") as f:
-        json.dump(failed_repos, f, indent=4)
-
-def clone_repository(git_url):
-    """Clones the GitHub repository to clone_repos_folder and returns the local path."""
-    repo_name = git_url.split("/")[-1].replace(".git", "")
-    repo_path = os.path.join(repos_folder, repo_name)
-    if not os.path.exists(repo_path):
-        print(f"Cloning {repo_name}...")
-        try:
-            Repo.clone_from(git_url, repo_path)
-        except Exception as e:
-            print(f"Error cloning {repo_name}: {e}")
-            log_failed_repo(git_url, str(e))  # Log the failure
-            return None
-    else:
-        print(f"{repo_name} already cloned.")
-    return repo_path
+    # Several CK runs may fail at the same time
+    with failed_repos_lock:
+        failed_repos = []
+
+        if os.path.exists(failed_repos_file):
+            with open(failed_repos_file, "r") as f:
+                failed_repos = json.load(f)
+
+        failed_repos.append({"repo_url": repo_url, "reason": reason})
+
+        with open(failed_repos_file, "w") as f:
+            json.dump(failed_repos, f, indent=4)
+
+def run_ck(source_dir, output_dir, heap_mb=2048):
+    """Runs CK on source_dir, which writes class.csv and method.csv into output_dir."""
+    # CK appends the file names to the output directory as is, so it must end with a separator
+    command = [
+        "java", f"-Xmx{heap_mb}m", "-jar", ck_jar_path, source_dir, "false", "0", "false", os.path.join(output_dir, "")]
+    return subprocess.run(command, check=True, capture_output=True, text=True)
+
+def get_java_source_size(repo_path):
+    total = 0
+    for root, dirs, files in os.walk(repo_path):
+        if '.git' in dirs:
+            dirs.remove('.git')
+        for name in files:
+            if name.endswith('.java'):
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+    return total
+
+def get_ck_heap(repo_path):
+    """Heap for the CK JVM of a repository, in MB, growing with the size of its Java sources."""
+    source_mb = get_java_source_size(repo_path) / (1 << 20)
+    return int(min(max_ck_heap, max(min_ck_heap, min_ck_heap + source_mb * ck_heap_per_source_mb)))
+
+def get_available_memory_mb():
+    try:
+        import psutil
+        return psutil.virtual_memory().available >> 20
+    except ImportError:
+        pass
+    try:
+        return (os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_AVPHYS_PAGES')) >> 20
+    except (ValueError, OSError, AttributeError):
+        # Unknown (e.g. Windows without psutil), assume room for one run per core
+        return None
+
+class Memory_Budget:
+    """Lets CK runs start only while the sum of their heaps fits in the available memory."""
+    def __init__(self, total_mb):
+        self.total_mb = total_mb
+        self.used_mb = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, heap_mb):
+        with self.condition:
+            # A run bigger than the whole budget still goes, alone
+            while self.used_mb and self.total_mb is not None and self.used_mb + heap_mb > self.total_mb:
+                self.condition.wait()
+            self.used_mb += heap_mb
+
+    def release(self, heap_mb):
+        with self.condition:
+            self.used_mb -= heap_mb
+            self.condition.notify_all()
 
 # analysis of class and method metrics
-def run_ck_analysis(repo_path):
+def run_ck_analysis(repo_path, memory_budget=None):
     """Runs CK on the cloned repository and saves output as separate CSV files."""
+    # Private scratch directory, so concurrent runs never read each other's class.csv/method.csv
+    scratch_dir = tempfile.mkdtemp(prefix=f"ck_{os.path.basename(repo_path)}_", dir=output_data_folder)
     try:
-        print(f"Running CK analysis on {repo_path}...")
-        # command = [
-        #     "java", "-jar", ck_jar_path, repo_path, "false", "0", "false", output_data_folder
-        # ]
-        command = [
-            "java", "-Xmx2g", "-jar", ck_jar_path, repo_path, "false", "0", "false", output_data_folder]
-
-        result = subprocess.run(command, check=True, capture_output=True, text=True)
-        
+        heap_mb = get_ck_heap(repo_path)
+        if memory_budget is not None:
+            memory_budget.acquire(heap_mb)
+        try:
+            print(f"Running CK analysis on {repo_path} with {heap_mb} MB...")
+            result = run_ck(repo_path, scratch_dir, heap_mb)
+        finally:
+            if memory_budget is not None:
+                memory_budget.release(heap_mb)
+
         # Print CK's standard output and error for debugging
         print("CK Output:\n", result.stdout)
         print("CK Errors:\n", result.stderr)
 
-        # Now check if the output files exist in output_data_folder
-        class_metrics_file = os.path.join(output_data_folder, "class.csv")
-        method_metrics_file = os.path.join(output_data_folder, "method.csv")
-        
-        # Create lists to hold class and method metrics
-        class_metrics_data = []
-        method_metrics_data = []
-
-        # Read class-level metrics into JSON
-        if os.path.exists(class_metrics_file):
-            with open(class_metrics_file, "r") as f:
-                headers = f.readline().strip().split(",")
-                for line in f:
-                    values = line.strip().split(",")
-                    class_metrics = dict(zip(headers, values))
-                    class_metrics_data.append(class_metrics)
-        
-        # Read method-level metrics into JSON
-        if os.path.exists(method_metrics_file):
-            with open(method_metrics_file, "r") as f:
-                headers = f.readline().strip().split(",")
-                for line in f:
-                    values = line.strip().split(",")
-                    method_metrics = dict(zip(headers, values))
-                    method_metrics_data.append(method_metrics)
+        # Now check if the output files exist in the scratch directory
+        class_metrics_file = os.path.join(scratch_dir, "class.csv")
+        method_metrics_file = os.path.join(scratch_dir, "method.csv")
         
         # Create a unique output folder for each repository (under their repo name)
         repo_name = os.path.basename(repo_path)
         repo_output_folder = os.path.join(output_data_folder, repo_name)
         Path(repo_output_folder).mkdir(parents=True, exist_ok=True)
 
-        # Save class metrics to a JSON file
-        class_metrics_json_file = os.path.join(repo_output_folder, f'{repo_name}_class_metrics.json')
-        with open(class_metrics_json_file, "w") as json_file:
-            json.dump(class_metrics_data, json_file, indent=4)
-        print(f"Class metrics saved to {class_metrics_json_file}")
-
-        # Save method metrics to a JSON file
-        method_metrics_json_file = os.path.join(repo_output_folder, f'{repo_name}_method_metrics.json')
-        with open(method_metrics_json_file, "w") as json_file:
-            json.dump(method_metrics_data, json_file, indent=4)
-        print(f"Method metrics saved to {method_metrics_json_file}")
-
-
+        # Stream the CSVs into typed columnar files (Parquet, or compressed NPZ without pyarrow)
         if os.path.exists(class_metrics_file):
-            os.remove(class_metrics_file)
-            print(f"Deleted {class_metrics_file}")
+            class_metrics_path, rows = convert_ck_csv(class_metrics_file, os.path.join(repo_output_folder, f'{repo_name}_class_metrics'))
+            print(f"Class metrics ({rows} classes) saved to {class_metrics_path}")
 
         if os.path.exists(method_metrics_file):
-            os.remove(method_metrics_file)
-            print(f"Deleted {method_metrics_file}")
+            method_metrics_path, rows = convert_ck_csv(method_metrics_file, os.path.join(repo_output_folder, f'{repo_name}_method_metrics'))
+            print(f"Method metrics ({rows} methods) saved to {method_metrics_path}")
 
     except subprocess.CalledProcessError as e:
         print(f"CK analysis failed for {repo_path}: {e}")
         log_failed_repo(repo_path, str(e))  # Log the failure
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
 
-# delete the repo after analysis
-def clean_up(repo_path):
+# delete the checkout after analysis, the mirror stays in the store
+def clean_up(repo_path, store):
     if os.path.exists(repo_path):
-        shutil.rmtree(repo_path)
+        store.release(repo_path)
         print(f"Deleted repository at {repo_path} to save space.")
 
-def fetch_and_analyze_repos(file_path):
-    """Fetches repositories using fetch_repos.py and analyzes them."""
-    print("Fetching and cloning repositories...")
-    cloned_repos = fetch_and_clone_repositories(file_path)  # Pass file_path for the CSV
-    if not cloned_repos:
-        print("No repositories to analyze.")
-        return
-
-    for repo_url in cloned_repos:
-        print(f"Analyzing repository: {repo_url}")
-        repo_path = clone_repository(repo_url)
-        
-        # If cloning failed, skip further analysis for this repo
-        if not repo_path:
-            print(f"Skipping analysis for {repo_url} due to cloning error.")
-            continue
+def get_ck_workers():
+    """CK runs at once: one per core, while their heaps fit in the available memory."""
+    cores = os.cpu_count() or 1
+    available_mb = get_available_memory_mb()
+    if available_mb is None:
+        return cores
+    return max(1, min(cores, available_mb // min_ck_heap))
 
-        run_ck_analysis(repo_path)
-        clean_up(repo_path)
+def analyze_and_clean_up(repo_path, memory_budget, store):
+    try:
+        print(f"Analyzing repository: {repo_path}")
+        run_ck_analysis(repo_path, memory_budget)
+    except Exception as e:
+        # Nobody waits on the pool's futures, record the error instead of losing it
+        print(f"CK analysis failed for {repo_path}: {e}")
+        log_failed_repo(repo_path, repr(e))
+    finally:
+        clean_up(repo_path, store)
+
+def fetch_and_analyze_repos(file_path, workers=None, store=None):
+    """Fetches repositories using fetch_repos.py and analyzes each one as soon as it is cloned.
+
+    Up to workers CK JVMs run at once, each with a heap sized to its repository and
+    admitted only while the heaps fit in the available memory. The repositories go
+    through store, by default the mirror store shared with clonning_repo.py.
+    """
+    store = store or Mirror_Store()
+    workers = workers or get_ck_workers()
+    memory_budget = Memory_Budget(get_available_memory_mb())
+    # Cloned repositories waiting for CK; the clones pause while the queue is full
+    pending = threading.Semaphore(workers * 2)
+    print(f"Fetching and cloning repositories, running up to {workers} CK analyses at once...")
+
+    analyzed = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for repo_url, repo_path, error in stream_cloned_repositories(file_path, repos_folder, store=store):  # Pass file_path for the CSV
+            # If cloning failed, skip further analysis for this repo
+            if error is not None:
+                print(f"Skipping analysis for {repo_url} due to cloning error.")
+                log_failed_repo(repo_url, str(error))  # Log the failure
+                continue
+
+            pending.acquire()
+            future = pool.submit(analyze_and_clean_up, repo_path, memory_budget, store)
+            future.add_done_callback(lambda _: pending.release())
+            analyzed += 1
+
+    if not analyzed:
+        print("No repositories to analyze.")
 
 def main():
     """Main function to initiate the fetch and analyze process."""
     # CSV file to automatically pick the github repo url one by one for cloning and analysis
     file_path = "ProjectGithubLinks.csv"  
-    fetch_and_analyze_repos(file_path)
+    # Shared with clonning_repo.py, so each repository is only downloaded once
+    fetch_and_analyze_repos(file_path, store=Mirror_Store())
     
 
 if __name__ == "__main__":
@@ -0,0 +1,219 @@
+import os
+import sys
+import json
+import shutil
+import argparse
+import subprocess
+from pathlib import Path
+from automate_ck_analysis import run_ck, repos_folder, output_data_folder, log_failed_repo
+from ck_results import read_ck_csv
+
+# json_stream and mirror_store live at the root of the project, next to clonning_repo.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from json_stream import iter_json_array, read_json_lines
+from mirror_store import Mirror_Store
+
+# CK only sees the changed files of a commit (see analyze_blobs), so these columns, which
+# depend on the other classes of the repository, are not those of a whole-repository run
+CROSS_CLASS_METRICS = ('cbo', 'cboModified', 'fanin', 'fanout', 'dit', 'noc', 'rfc')
+
+def list_java_blobs(repo_path, commit):
+    """Maps every .java path of commit to its blob id."""
+    result = subprocess.run(['git', '-C', repo_path, 'ls-tree', '-r', '-z', commit],
+                            check=True, capture_output=True, text=True, encoding='utf-8', errors='surrogateescape')
+    blobs = {}
+    for entry in result.stdout.split('\0'):
+        if not entry:
+            continue
+        info, path = entry.split('\t', 1)
+        mode, obj_type, blob_id = info.split()
+        if obj_type == 'blob' and mode.startswith('100') and path.endswith('.java'):
+            blobs[path] = blob_id
+    return blobs
+
+def diff_java_blobs(repo_path, old_commit, new_commit):
+    """Returns the .java paths changed between two commits with their new blob ids, and the deleted paths."""
+    result = subprocess.run(['git', '-C', repo_path, 'diff-tree', '-r', '-z', '--no-renames', old_commit, new_commit],
+                            check=True, capture_output=True, text=True, encoding='utf-8', errors='surrogateescape')
+    tokens = result.stdout.split('\0')
+    changed, deleted = {}, []
+    for info, path in zip(tokens[0::2], tokens[1::2]):
+        if not path.endswith('.java'):
+            continue
+        _, new_mode, _, new_blob, status = info.split()
+        if status == 'D':
+            deleted.append(path)
+        elif new_mode.startswith('100'):
+            changed[path] = new_blob
+    return changed, deleted
+
+def read_ck_rows(csv_path):
+    # Typed rows, so the cached metrics stay numbers
+    return read_ck_csv(csv_path).astype(object).to_dict('records')
+
+class Ck_Blob_Cache:
+    """CK class and method rows of each analyzed .java blob, appended to a JSON Lines file.
+
+    Rows are keyed by the blob id of the file they come from, so a file keeps its
+    results until its content changes, whatever its path or commit.
+    """
+    def __init__(self, cache_path:str):
+        self.cache_path = cache_path
+        self.blobs = {}
+        if os.path.exists(cache_path):
+            for entry in read_json_lines(cache_path):
+                self.blobs[entry['blob']] = entry
+
+    def __contains__(self, blob_id):
+        return blob_id in self.blobs
+
+    def get(self, blob_id):
+        return self.blobs.get(blob_id)
+
+    def add_all(self, entries):
+        with open(self.cache_path, 'a', encoding='utf-8') as f:
+            for entry in entries:
+                self.blobs[entry['blob']] = entry
+                f.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')))
+                f.write('\n')
+
+def update_worktree(worktree_path, commit, paths, deleted):
+    """Brings only the given paths of the reusable worktree to commit."""
+    for path in deleted:
+        file_path = os.path.join(worktree_path, path)
+        if os.path.exists(file_path):
+            os.remove(file_path)
+    if paths:
+        subprocess.run(['git', '-C', worktree_path, 'checkout', commit, '--pathspec-from-file=-', '--pathspec-file-nul'],
+                       input='\0'.join(paths), check=True, text=True, encoding='utf-8', errors='surrogateescape')
+
+def analyze_blobs(worktree_path, blobs, scratch_dir):
+    """Runs CK on just the given files of the worktree and returns their cache entries.
+
+    CK cannot see the unchanged files, so the metrics that depend on other classes
+    (CROSS_CLASS_METRICS: coupling, fan-in/out, RFC, DIT, NOC) only reflect the
+    files analyzed together, and stay cached with the blob: a class keeps its fan-in
+    when only its callers change. The per-file metrics (LOC, WMC, LCOM, TCC, counts
+    of methods, fields, loops...) are the same as in a whole-repository run.
+    """
+    source_dir = os.path.join(scratch_dir, 'src')
+    ck_output_dir = os.path.join(scratch_dir, 'out')
+    shutil.rmtree(scratch_dir, ignore_errors=True)
+    os.makedirs(ck_output_dir)
+
+    for path in blobs:
+        target = os.path.join(source_dir, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.link(os.path.join(worktree_path, path), target)
+        except OSError:
+            shutil.copyfile(os.path.join(worktree_path, path), target)
+
+    run_ck(source_dir, ck_output_dir)
+
+    # Files without any class (e.g. package-info.java) are cached too so they are not analyzed again
+    entries = {blob_id: {'blob': blob_id, 'class': [], 'method': []} for blob_id in blobs.values()}
+    for kind in ('class', 'method'):
+        for row in read_ck_rows(os.path.join(ck_output_dir, f'{kind}.csv')):
+            path = Path(os.path.relpath(row.pop('file'), source_dir)).as_posix()
+            if path in blobs:
+                entries[blobs[path]][kind].append(row)
+
+    shutil.rmtree(scratch_dir, ignore_errors=True)
+    return list(entries.values())
+
+def read_refactoring_commits(metrics_json_path):
+    # metrics_<repo>_output.json lists the refactoring commits in date order
+    return [commit['refactor_hash'] for commit in iter_json_array(metrics_json_path, 'commits_metrics')]
+
+def ck_evolution(repo_path, commits, output_dir, repo_name = None, worktree_path = None, store = None):
+    """Computes the CK metrics of each commit in commits, which should be in date order.
+
+    A reusable worktree follows the commits, checking out only the .java files that
+    changed since the previous one, and CK only runs on the blobs it has not seen
+    yet, so the cost grows with the churn instead of with commits x repository size.
+
+    Each line of ck_evolution_<repo>.jsonl holds the .java files added or changed
+    since the previous commit with their blob ids, and the deleted ones; the CK rows
+    of every blob are in ck_blobs_<repo>.jsonl. iter_ck_snapshots joins them back.
+    Only the per-file metrics are valid, see analyze_blobs.
+    """
+    store = store or Mirror_Store()
+    repo_name = repo_name or os.path.basename(os.path.normpath(repo_path))
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    evolution_path = os.path.join(output_dir, f'ck_evolution_{repo_name}.jsonl')
+    cache = Ck_Blob_Cache(os.path.join(output_dir, f'ck_blobs_{repo_name}.jsonl'))
+    scratch_dir = os.path.join(output_dir, f'ck_scratch_{repo_name}')
+
+    worktree_path = os.path.abspath(worktree_path or os.path.join(repos_folder, f'{repo_name}_evolution'))
+    if os.path.exists(worktree_path):
+        store.release(worktree_path)
+    subprocess.run(['git', '-C', repo_path, 'worktree', 'add', '--detach', '--no-checkout', worktree_path, commits[0]], check=True)
+
+    try:
+        with open(evolution_path, 'w', encoding='utf-8') as f:
+            previous = None
+            for commit in commits:
+                if previous is None:
+                    changed, deleted = list_java_blobs(repo_path, commit), []
+                else:
+                    changed, deleted = diff_java_blobs(repo_path, previous, commit)
+                update_worktree(worktree_path, commit, list(changed), deleted)
+
+                dirty = {path: blob_id for path, blob_id in changed.items() if blob_id not in cache}
+                # The same content may appear under several paths, analyze it once
+                dirty = {blob_id: path for path, blob_id in dirty.items()}
+                if dirty:
+                    print(f"Running CK on {len(dirty)} changed files of {commit}...")
+                    cache.add_all(analyze_blobs(worktree_path, {path: blob_id for blob_id, path in dirty.items()}, scratch_dir))
+
+                f.write(json.dumps({'commit': commit, 'changed': changed, 'deleted': deleted}, separators=(',', ':')))
+                f.write('\n')
+                previous = commit
+    finally:
+        store.release(worktree_path)
+
+    print(f"CK evolution of {len(commits)} commits saved to {evolution_path}")
+    return evolution_path
+
+def iter_ck_snapshots(evolution_path, cache_path, per_file_only = False):
+    """Yields (commit, {path: {'class': rows, 'method': rows}}) for each commit of an evolution file.
+
+    per_file_only drops the CROSS_CLASS_METRICS columns, which are not comparable
+    to a CK run on the whole repository.
+    """
+    cache = Ck_Blob_Cache(cache_path)
+    files = {}
+    for step in read_json_lines(evolution_path):
+        for path in step['deleted']:
+            files.pop(path, None)
+        files.update(step['changed'])
+        snapshot = {path: cache.get(blob_id) for path, blob_id in files.items()}
+        if per_file_only:
+            snapshot = {path: dict(entry, **{kind: [{k: v for k, v in row.items() if k not in CROSS_CLASS_METRICS} for row in entry[kind]]
+                                             for kind in ('class', 'method')}) if entry is not None else None
+                        for path, entry in snapshot.items()}
+        yield step['commit'], snapshot
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute the CK metrics of a repository at each of its refactoring commits.")
+    parser.add_argument('github_url')
+    parser.add_argument('metrics_json', help="metrics_<repo>_output.json written by clonning_repo.py")
+    args = parser.parse_args()
+
+    repo_name = args.github_url.split("/")[-1].replace(".git", "")
+    commits = read_refactoring_commits(args.metrics_json)
+    if not commits:
+        print("No refactoring commits to analyze.")
+        return
+
+    try:
+        store = Mirror_Store()
+        mirror_path = store.fetch(args.github_url)
+        ck_evolution(mirror_path, commits, os.path.join(output_data_folder, repo_name), repo_name, store=store)
+    except subprocess.CalledProcessError as e:
+        print(f"CK evolution failed for {args.github_url}: {e}")
+        log_failed_repo(args.github_url, str(e))
+
+if __name__ == "__main__":
+    main()
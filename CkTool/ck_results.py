@@ -0,0 +1,110 @@
+import os
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Rows read from the CK CSVs at a time, bounds the memory used while converting
+CHUNK_ROWS = 200_000
+
+# Every other CK column is an integer metric
+TEXT_COLUMNS = {'file', 'class', 'type', 'method'}
+BOOL_COLUMNS = {'constructor', 'hasJavaDoc'}
+FLOAT_COLUMNS = {'lcom*', 'tcc', 'lcc'}
+
+def get_ck_dtypes(csv_path):
+    """Explicit dtypes for the columns of a CK class.csv or method.csv."""
+    with open(csv_path, 'r', encoding='utf-8') as f:
+        header = pd.read_csv(f, nrows=0).columns
+    dtypes = {}
+    for column in header:
+        if column in TEXT_COLUMNS:
+            dtypes[column] = str
+        elif column in BOOL_COLUMNS:
+            dtypes[column] = bool
+        elif column in FLOAT_COLUMNS:
+            dtypes[column] = np.float64
+        else:
+            dtypes[column] = np.int64
+    return dtypes
+
+def iter_ck_csv(csv_path, chunk_rows = CHUNK_ROWS):
+    """Yields typed DataFrame chunks of a CK CSV, honouring quoted fields such as method signatures."""
+    dtypes = get_ck_dtypes(csv_path)
+    chunks = pd.read_csv(csv_path, dtype=dtypes, chunksize=chunk_rows, true_values=['true'], false_values=['false'],
+                         keep_default_na=False, na_values={column: ['NaN', ''] for column in FLOAT_COLUMNS})
+    with chunks as reader:
+        yield from reader
+
+def read_ck_csv(csv_path):
+    if not os.path.exists(csv_path):
+        return pd.DataFrame()
+    frames = list(iter_ck_csv(csv_path))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+def get_metrics_path(output_base):
+    # Parquet when pyarrow is installed, compressed NPZ otherwise
+    return output_base + ('.parquet' if pa is not None else '.npz')
+
+def convert_ck_csv(csv_path, output_base, chunk_rows = CHUNK_ROWS):
+    """Streams a CK CSV into <output_base>.parquet (or .npz) and returns the path and the row count."""
+    output_path = get_metrics_path(output_base)
+    rows = 0
+    if pa is not None:
+        writer = None
+        try:
+            for chunk in iter_ck_csv(csv_path, chunk_rows):
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(output_path, table.schema, compression='zstd')
+                writer.write_table(table)
+                rows += len(chunk)
+        finally:
+            if writer is not None:
+                writer.close()
+        if writer is None:
+            pq.write_table(pa.table({}), output_path)
+        return output_path, rows
+
+    # NPZ cannot be appended to; only the typed column arrays are kept until the end
+    columns = {}
+    for chunk in iter_ck_csv(csv_path, chunk_rows):
+        for name in chunk.columns:
+            columns.setdefault(name, []).append(chunk[name].to_numpy())
+        rows += len(chunk)
+
+    # Stored by position: CK column names such as 'file' or 'lcom*' are not usable as savez keywords
+    arrays = {}
+    for i, parts in enumerate(columns.values()):
+        values = np.concatenate(parts)
+        if values.dtype == object:
+            # Paths and class names repeat on every method row, keep each distinct string once
+            codes, uniques = pd.factorize(values)
+            arrays[f'column_{i}'] = codes.astype(np.int32)
+            arrays[f'column_{i}_values'] = np.asarray(uniques, dtype=str)
+        elif values.dtype == np.int64 and len(values):
+            # Most metrics are small counts; the narrowest integer type compresses several times faster
+            arrays[f'column_{i}'] = values.astype(np.result_type(np.min_scalar_type(values.min()), np.min_scalar_type(values.max())))
+        else:
+            arrays[f'column_{i}'] = values
+    np.savez_compressed(output_path, columns=np.array(list(columns), dtype=str), **arrays)
+    return output_path, rows
+
+def load_ck_metrics(path):
+    """Loads a file written by convert_ck_csv back into a DataFrame."""
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    with np.load(path, allow_pickle=False) as data:
+        frame = {}
+        for i, name in enumerate(data['columns']):
+            values = data[f'column_{i}']
+            if f'column_{i}_values' in data.files:
+                values = data[f'column_{i}_values'][values]
+            elif values.dtype.kind in 'iu':
+                values = values.astype(np.int64)
+            frame[str(name)] = values
+        return pd.DataFrame(frame)
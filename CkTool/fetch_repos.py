@@ -1,7 +1,15 @@
 import pandas as pd
 import os
-from git import Repo
-import time
+import sys
+import queue
+import asyncio
+import threading
+from collections import defaultdict
+from urllib.parse import urlparse
+
+# The mirror store lives at the root of the project, next to clonning_repo.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from mirror_store import Mirror_Store
 
 def fetch_github_links_from_csv(file_path):
     """Fetch GitHub links from a CSV file."""
@@ -17,51 +25,117 @@ def fetch_github_links_from_csv(file_path):
     
     return github_links
 
-def fetch_and_clone_repositories(file_path, repos_folder="./cloned_repos/", max_retries=3):
-    """Fetch and clone GitHub repositories from CSV links with retry logic."""
+def get_clone_env():
+    """Environment of the git subprocesses, leaving os.environ untouched."""
+    env = dict(os.environ)
+    # Avoid errors when fetching large repos over slow connections
+    env['GIT_HTTP_LOW_SPEED_LIMIT'] = '0'  # Disable speed limit
+    env['GIT_HTTP_LOW_SPEED_TIME'] = '999999'  # Allow longer time to fetch
+    return env
+
+def get_clone_options(depth=None, partial=False):
+    """Extra git clone options: a shallow clone of depth commits and/or a blobless partial clone."""
+    options = []
+    if depth:
+        options.append(f'--depth={depth}')
+    if partial:
+        options.append('--filter=blob:none')
+    return options
+
+def get_host(link):
+    # file:// fixtures and local paths share the 'local' slots
+    return urlparse(link).hostname or 'local'
+
+async def clone_repository_async(link, repos_folder, store, slots, host_slots, max_retries, retry_delay, options, env):
+    """Fetches link into the mirror store and checks it out, retrying with exponential backoff."""
+    repo_name = link.split("/")[-1].replace(".git", "")
+    repo_path = os.path.join(repos_folder, repo_name)
+
+    # Check if the repo is already cloned (i.e., if the folder exists)
+    if os.path.exists(repo_path):
+        print(f"Repository {repo_name} already exists at {repo_path}. Skipping clone.")
+        return repo_path
+
+    loop = asyncio.get_running_loop()
+    for attempt in range(1, max_retries + 1):
+        try:
+            async with host_slots[get_host(link)], slots:
+                print(f"Cloning {repo_name} from {link}...")
+                await store.fetch_async(link, options, env)
+            return await loop.run_in_executor(None, store.checkout, link, repo_path)
+        except Exception as e:
+            print(f"Error cloning {repo_name}, attempt {attempt}: {e}")
+            if attempt == max_retries:
+                print(f"Failed to clone {repo_name} after {max_retries} attempts.")
+                raise
+            delay = retry_delay * 2 ** (attempt - 1)
+            print(f"Retrying {repo_name} in {delay} seconds...")
+            await asyncio.sleep(delay)
+
+async def iter_cloned_repositories(github_links, repos_folder, store, workers, per_host, max_retries, retry_delay, options):
+    """Clones up to workers repositories at once (per_host per host) and yields (link, repo_path, error) as each finishes."""
+    slots = asyncio.Semaphore(workers)
+    host_slots = defaultdict(lambda: asyncio.Semaphore(per_host))
+    env = get_clone_env()
+
+    async def clone(link):
+        try:
+            return link, await clone_repository_async(link, repos_folder, store, slots, host_slots, max_retries, retry_delay, options, env), None
+        except Exception as e:
+            return link, None, e
+
+    tasks = [asyncio.ensure_future(clone(link)) for link in github_links]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def stream_cloned_repositories(file_path, repos_folder="./cloned_repos/", max_retries=3, store=None, workers=4, per_host=2,
+                               retry_delay=5, depth=None, partial=False):
+    """Yields (link, repo_path, error) for each repository of the CSV as soon as its clone is ready.
+
+    The clones run on an asyncio event loop in a background thread. At most workers
+    finished clones wait to be consumed, so a slow consumer (such as CK) does not let
+    the checkouts pile up on disk.
+    """
     github_links = fetch_github_links_from_csv(file_path)
-    
     if not github_links:
         print("No GitHub links found.")
-        return []    
-
-    cloned_repos = []
+        return
 
+    store = store or Mirror_Store()
+    options = get_clone_options(depth, partial)
     # Ensure the repos folder exists
-    if not os.path.exists(repos_folder):
-        os.makedirs(repos_folder)
-    
-    for link in github_links:
-        # Extract the repo name from the URL
-        repo_name = link.split("/")[-1].replace(".git", "")
-        repo_path = os.path.join(repos_folder, repo_name)
-        
-        # Check if the repo is already cloned (i.e., if the folder exists)
-        if os.path.exists(repo_path):
-            print(f"Repository {repo_name} already exists at {repo_path}. Skipping clone.")
-            cloned_repos.append(repo_path)
-        else:
-            print(f"Cloning {repo_name} from {link}...")
-
-            # Set the Git buffer size to avoid errors with large repos
-            os.environ['GIT_HTTP_LOW_SPEED_LIMIT'] = '0'  # Disable speed limit
-            os.environ['GIT_HTTP_LOW_SPEED_TIME'] = '999999'  # Allow longer time to fetch
-            
-            attempt = 0
-            while attempt < max_retries:
-                try:
-                    # Clone the repository
-                    Repo.clone_from(link, repo_path)
-                    cloned_repos.append(repo_path)
-                    break  # Exit the retry loop if successful
-                except Exception as e:
-                    print(f"Error cloning {repo_name}, attempt {attempt + 1}: {e}")
-                    attempt += 1
-                    if attempt < max_retries:
-                        print(f"Retrying in 5 seconds...")
-                        time.sleep(5)  # Wait before retrying
-                    else:
-                        print(f"Failed to clone {repo_name} after {max_retries} attempts.")
-    
-    return cloned_repos
+    os.makedirs(repos_folder, exist_ok=True)
+
+    results = queue.Queue(maxsize=workers)
+    finished = object()
+
+    async def produce():
+        loop = asyncio.get_running_loop()
+        async for result in iter_cloned_repositories(github_links, repos_folder, store, workers, per_host, max_retries, retry_delay, options):
+            # Wait in a thread so the clones still in flight keep running
+            await loop.run_in_executor(None, results.put, result)
+
+    def run():
+        try:
+            asyncio.run(produce())
+        finally:
+            results.put(finished)
+
+    threading.Thread(target=run, daemon=True).start()
+    while (result := results.get()) is not finished:
+        yield result
+
+def fetch_and_clone_repositories(file_path, repos_folder="./cloned_repos/", max_retries=3, store=None, workers=4, per_host=2,
+                                 retry_delay=5, depth=None, partial=False):
+    """Fetch and clone GitHub repositories from CSV links with retry logic.
 
+    Repositories are fetched into the shared mirror store and checked out as
+    shared clones of their mirror, so a repository already mined by clonning_repo.py is not downloaded again.
+    """
+    return [repo_path for _, repo_path, error in
+            stream_cloned_repositories(file_path, repos_folder, max_retries, store, workers, per_host, retry_delay, depth, partial)
+            if error is None]
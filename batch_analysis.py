@@ -0,0 +1,99 @@
+import os
+import sys
+import csv
+import json
+import argparse
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from clonning_repo import analyze_repo
+from mirror_store import Mirror_Store
+
+_clone_slots = None
+
+def read_repo_urls(file_path):
+    """Reads GitHub URLs from a plain list (one per line) or a CSV with a 'project_url' column."""
+    urls = []
+    with open(file_path, 'r', encoding='utf-8') as f:
+        if file_path.endswith('.csv'):
+            urls = [row['project_url'] for row in csv.DictReader(f) if row.get('project_url')]
+        else:
+            urls = [line.strip() for line in f if line.strip()]
+
+    # Keep the file order but drop duplicates
+    return list(dict.fromkeys(url.strip() for url in urls))
+
+def _init_worker(clone_slots):
+    global _clone_slots
+    _clone_slots = clone_slots
+
+def analyze_one(github_url, repos_dir, outputs_dir, backend = 'pydriller', rm_jobs = 1, rm_heap = None, store = None, metrics_store = None,
+                profile = None, artifact_format = None, package_workers = 1):
+    """Runs the whole pipeline for one repository, returning a status record instead of raising."""
+    try:
+        json_path = analyze_repo(github_url, repos_dir, outputs_dir, _clone_slots, backend, rm_jobs, rm_heap, store, metrics_store, profile,
+                                 artifact_format, package_workers)
+        return {"repo_url": github_url, "status": "done", "output": json_path}
+    except BaseException as e:
+        # Includes SystemExit so one broken repository never takes the worker down
+        return {"repo_url": github_url, "status": "failed", "reason": repr(e), "traceback": traceback.format_exc()}
+
+def run_batch(file_path, workers, max_clones = None, root_dir = None, backend = 'pydriller', rm_jobs = 1, rm_heap = None, store = None,
+              metrics_store = None, profile = None, artifact_format = None, package_workers = 1):
+    root_dir = root_dir or os.getcwd()
+    repos_dir = os.path.join(root_dir, 'repos')
+    outputs_dir = os.path.join(root_dir, 'outputs')
+    os.makedirs(repos_dir, exist_ok=True)
+    os.makedirs(outputs_dir, exist_ok=True)
+
+    urls = read_repo_urls(file_path)
+    print(f"Analyzing {len(urls)} repositories with {workers} workers")
+
+    # At most max_clones repositories are on disk at the same time
+    clone_slots = multiprocessing.Semaphore(max_clones or workers)
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(clone_slots,)) as pool:
+        futures = {pool.submit(analyze_one, url, repos_dir, outputs_dir, backend, rm_jobs, rm_heap, store, metrics_store, profile,
+                               artifact_format, package_workers): url for url in urls}
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            print(f"[{len(results)}/{len(urls)}] {result['status']}: {result['repo_url']}")
+
+    report_path = os.path.join(outputs_dir, 'batch_report.json')
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=4)
+
+    failed = [r for r in results if r['status'] != 'done']
+    print(f"{len(results) - len(failed)} repositories analyzed, {len(failed)} failed. Report saved to {report_path}")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze a list of GitHub repositories in parallel.")
+    parser.add_argument('file_path', help="selenium_links.txt style list or ProjectGithubLinks.csv style CSV")
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    parser.add_argument('-c', '--max-clones', type=int, default=None, help="maximum clones kept on disk at once (defaults to --workers)")
+    parser.add_argument('--backend', choices=['pydriller', 'git'], default='pydriller', help="history traversal backend")
+    parser.add_argument('--rm-jobs', type=int, default=1, help="RefactoringMiner JVMs run at once for each repository, "
+                        "over the commits reachable from HEAD only")
+    parser.add_argument('--rm-heap', default=None, help="maximum heap of each RefactoringMiner JVM, e.g. 4g")
+    parser.add_argument('--store-dir', default=None, help="shared mirror store (defaults to $MIRROR_STORE_DIR or ~/.cache/repo_mirrors)")
+    parser.add_argument('--store-quota', default=None, help="disk quota of the mirror store, e.g. 50G")
+    parser.add_argument('--metrics-store', choices=['sqlite', 'parquet'], default=None, help="also save the metrics as columnar tables")
+    parser.add_argument('--profile', choices=['cprofile', 'pyinstrument'], default=None, help="profile each repository's run")
+    parser.add_argument('--artifact-format', choices=['gzip', 'zstd', 'msgpack'], default=None,
+                        help="format of the ordered_msg and filtered outputs (JSON by default)")
+    parser.add_argument('--package-workers', type=int, default=1,
+                        help="processes reading Java packages for each repository, on top of the --workers processes")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.file_path):
+        print("File does not exists")
+        sys.exit(1)
+
+    run_batch(args.file_path, args.workers, args.max_clones, backend=args.backend, rm_jobs=args.rm_jobs, rm_heap=args.rm_heap,
+              store=Mirror_Store(args.store_dir, args.store_quota), metrics_store=args.metrics_store, profile=args.profile,
+              artifact_format=args.artifact_format, package_workers=args.package_workers)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,445 @@
+import io
+import os
+import json
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+from contextlib import nullcontext, redirect_stdout
+from datetime import datetime, timezone
+import clonning_repo
+import create_graph
+from history_store import History_Store
+from json_stream import iter_json_array, read_records
+from run_report import Run_Report
+
+# Scales (commits) run by default, small enough for pydriller to finish in a few minutes
+SCALES = (200, 1000, 5000)
+REFACTORING_TYPES = ['Rename Method', 'Extract Method', 'Move Method', 'Rename Variable', 'Change Return Type',
+                     'Extract Class', 'Move Class', 'Inline Method']
+MESSAGES = ['Refactor {cls}', 'Fix #{n} in {cls}', 'BugFix #{n} null check', 'Add {cls} feature', 'Solved #{n}',
+            'Cleanup of {pkg}', 'Update {cls}']
+MBASSADOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'outputs', 'mbassador')
+MBASSADOR_URL = 'https://github.com/bennidi/mbassador.git'
+START_DATE = 1400000000
+
+class Synthetic_Repo:
+    """A local git repository with a random but reproducible Java history, built with git fast-import.
+
+    files .java files are spread over packages packages under src/main/java (plus a
+    pom.xml and a README.md) and changed by authors developers over commits commits.
+    Each commit adds, changes, renames or deletes a few files, and now and then changes
+    the package a file declares. make_refactoring_miner_output
+    then writes a RefactoringMiner-like <name>_output.json for it, so the whole
+    pipeline runs without Java.
+    """
+    def __init__(self, path:str, commits:int, files:int = 200, authors:int = 20, packages:int = 10, seed:int = 0):
+        self.path = path
+        self.commits = commits
+        self.files = files
+        self.authors = authors
+        self.packages = packages
+        self.seed = seed
+        self.hashes = []
+        # Java files touched by each commit, in commit order, for the canned refactorings
+        self.touched = []
+
+    def package_names(self):
+        return [f'org.bench.module{i % 7}.part{i}' for i in range(self.packages)]
+
+    def create(self):
+        rnd = random.Random(self.seed)
+        packages = self.package_names()
+        developers = [(f'Developer {i}', f'dev{i}@bench.org') for i in range(self.authors)]
+        contents = {}
+        next_class = 0
+        date = START_DATE
+
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.makedirs(self.path)
+        subprocess.run(['git', 'init', '-q', self.path], check=True)
+        subprocess.run(['git', '-C', self.path, 'symbolic-ref', 'HEAD', 'refs/heads/main'], check=True)
+
+        marks_path = os.path.join(self.path, '.git', 'bench_marks')
+        importer = subprocess.Popen(['git', '-C', self.path, 'fast-import', '--quiet', f'--export-marks={marks_path}'],
+                                    stdin=subprocess.PIPE)
+        stream = importer.stdin
+
+        def data(text):
+            raw = text.encode('utf-8')
+            stream.write(b'data %d\n' % len(raw))
+            stream.write(raw)
+            stream.write(b'\n')
+
+        for n in range(self.commits):
+            date += rnd.randint(60, 3 * 24 * 60 * 60)
+            author = rnd.choice(developers)
+            # Now and then the change is applied by somebody else
+            commiter = rnd.choice(developers) if rnd.random() < 0.2 else author
+            changes = {}
+            # Deletes and renames, written in the order they happen before the changed files
+            operations = []
+
+            for _ in range(rnd.randint(1, 5)):
+                java_paths = [p for p in contents if p.endswith('.java')]
+                action = rnd.random()
+                if not java_paths or (action < 0.15 and len(java_paths) < self.files):
+                    package = rnd.choice(packages)
+                    path = f"src/main/java/{package.replace('.', '/')}/Class{next_class}.java"
+                    next_class += 1
+                    contents[path] = [f'package {package};', '', f'public class {os.path.basename(path)[:-5]} {{', '}']
+                elif action < 0.18 and len(java_paths) > 1:
+                    path = rnd.choice(java_paths)
+                    del contents[path]
+                    changes.pop(path, None)
+                    operations.append(f'D {path}')
+                    continue
+                elif action < 0.21 and any(p not in changes for p in java_paths):
+                    # Moved to another package unchanged, a pure rename
+                    path = rnd.choice([p for p in java_paths if p not in changes])
+                    package = rnd.choice(packages)
+                    new_path = f"src/main/java/{package.replace('.', '/')}/Class{next_class}.java"
+                    next_class += 1
+                    contents[new_path] = contents.pop(path)
+                    operations.append(f'R {path} {new_path}')
+                    continue
+                elif action < 0.22:
+                    path = rnd.choice(['pom.xml', 'README.md'])
+                    contents.setdefault(path, [])
+                elif action < 0.25:
+                    # Declared in another package without moving, so its package depends on the commit
+                    path = rnd.choice(java_paths)
+                    contents[path][0] = f'package {rnd.choice(packages)};'
+                else:
+                    path = rnd.choice(java_paths)
+
+                lines = contents[path]
+                body_start = 3 if path.endswith('.java') else 0
+                body_end = len(lines) - 1 if path.endswith('.java') else len(lines)
+                for _ in range(rnd.randint(0, min(body_end - body_start, 5))):
+                    del lines[rnd.randrange(body_start, body_end)]
+                    body_end -= 1
+                for _ in range(rnd.randint(1, 20)):
+                    lines.insert(rnd.randint(body_start, body_end), f'    int field{rnd.randrange(1 << 20)} = {n};')
+                    body_end += 1
+                changes[path] = lines
+
+            cls = os.path.basename(next(iter(changes), 'Main.java')).split('.')[0]
+            msg = rnd.choice(MESSAGES).format(cls=cls, pkg=rnd.choice(packages), n=rnd.randint(1, 999))
+            stream.write(b'commit refs/heads/main\n')
+            stream.write(b'mark :%d\n' % (n + 1))
+            stream.write(f'author {author[0]} <{author[1]}> {date} +0000\n'.encode('utf-8'))
+            stream.write(f'committer {commiter[0]} <{commiter[1]}> {date} +0000\n'.encode('utf-8'))
+            data(msg)
+            for operation in operations:
+                stream.write(f'{operation}\n'.encode('utf-8'))
+            for path, lines in changes.items():
+                stream.write(f'M 100644 inline {path}\n'.encode('utf-8'))
+                data('\n'.join(lines) + '\n')
+            renamed = [operation.split()[2] for operation in operations if operation[0] == 'R']
+            self.touched.append([p for p in changes if p.endswith('.java')] + [p for p in renamed if p in contents and p not in changes])
+
+        stream.close()
+        if importer.wait() != 0:
+            raise RuntimeError(f"git fast-import failed for {self.path}")
+        subprocess.run(['git', '-C', self.path, 'checkout', '-q', '-f', 'main'], check=True)
+
+        with open(marks_path, 'r', encoding='utf-8') as f:
+            marks = dict(line.split() for line in f)
+        self.hashes = [marks[f':{n + 1}'] for n in range(self.commits)]
+        return self
+
+    def make_refactoring_miner_output(self, json_path:str, ratio:float = 0.2):
+        """Writes the RefactoringMiner output of the repository: ratio of the commits that touch Java files get refactorings."""
+        rnd = random.Random(self.seed + 1)
+        commits = []
+        # RefactoringMiner lists the commits from the newest one
+        for sha1, touched in reversed(list(zip(self.hashes, self.touched))):
+            refactorings = []
+            if touched and rnd.random() < ratio:
+                for _ in range(rnd.randint(1, 3)):
+                    path = rnd.choice(touched)
+                    cls = os.path.basename(path)[:-5]
+                    location = {'filePath': path, 'startLine': 3, 'endLine': 4, 'startColumn': 1, 'endColumn': 2,
+                                'codeElementType': 'METHOD_DECLARATION', 'description': 'original method declaration',
+                                'codeElement': 'public method() : void'}
+                    refactorings.append({'type': rnd.choice(REFACTORING_TYPES),
+                                         'description': f'Refactoring of method() in class {cls}',
+                                         'leftSideLocations': [location], 'rightSideLocations': [dict(location)]})
+            commits.append({'repository': self.path, 'sha1': sha1, 'url': f'{self.path}/commit/{sha1}',
+                            'refactorings': refactorings})
+
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump({'commits': commits}, f, indent='\t')
+        return json_path
+
+def pipeline_output(verbose:bool):
+    # The pipeline prints a line per step, only keep them when asked
+    return nullcontext() if verbose else redirect_stdout(io.StringIO())
+
+def run_pipeline(repo_path:str, json_path:str, backend:str = 'pydriller', lean:bool = False, report:Run_Report = None,
+                 artifact_format:str = None):
+    """Runs filter, traversal, metrics and plot on a repository whose RefactoringMiner output is json_path, one stage each."""
+    report = report or Run_Report()
+    with report.stage('filter_commits_with_refactorings') as items:
+        filtered = clonning_repo.filter_commits_with_refactorings(json_path, artifact_format)
+        items['refactoring_commits'] = len(filtered)
+    with report.stage('save_commit_messages') as items:
+        ref_commits, total_commits, index = clonning_repo.save_commit_messages(filtered, repo_path, json_path, lean=lean,
+                                                                              backend=backend, report=report,
+                                                                              artifact_format=artifact_format)
+        items['commits'] = len(total_commits)
+    with report.stage('get_metrics') as items:
+        metrics_path = clonning_repo.get_metrics(total_commits, ref_commits, json_path, index, report=report)
+        items['commits'] = len(total_commits)
+    with report.stage('doPlot') as items:
+        create_graph.doPlot(metrics_path)
+        items['refactoring_commits'] = len(ref_commits)
+    return metrics_path
+
+def get_throughput(report:Run_Report, commits:int):
+    # Top level stages only; the steps nested in them are in the saved report
+    rows = []
+    for record in report.stages:
+        if '.' in record['stage'] or 'wall_s' not in record:
+            continue
+        rows.append({'stage': record['stage'], 'wall_s': record['wall_s'], 'cpu_s': record['cpu_s'],
+                     'peak_rss_mb': record['peak_rss_mb'],
+                     'commits_per_s': round(commits / record['wall_s'], 1) if record['wall_s'] > 0 else None})
+    return rows
+
+def benchmark_scale(work_dir:str, commits:int, files:int, authors:int, packages:int, backend:str = 'pydriller',
+                    lean:bool = False, ratio:float = 0.2, seed:int = 0, verbose:bool = False, artifact_format:str = None):
+    name = f'synthetic_{commits}'
+    repo = Synthetic_Repo(os.path.join(work_dir, 'repos', name), commits, files, authors, packages, seed)
+    output_dir = os.path.join(work_dir, 'outputs', name)
+    os.makedirs(output_dir, exist_ok=True)
+    json_path = os.path.join(output_dir, f'{name}_output.json')
+
+    report = Run_Report(command='benchmark')
+    with report:
+        with report.stage('create_repo') as items:
+            repo.create().make_refactoring_miner_output(json_path, ratio)
+            items['commits'] = commits
+        with pipeline_output(verbose):
+            run_pipeline(repo.path, json_path, backend, lean, report, artifact_format)
+
+    return {'commits': commits, 'files': files, 'authors': authors, 'packages': packages, 'backend': backend,
+            'lean': lean, 'artifact_format': artifact_format, 'stages': get_throughput(report, commits), 'steps': report.stages}
+
+def compare_entries(expected, actual, key):
+    """Counts the entries of actual equal to the entry of expected with the same key."""
+    expected_by_key = {entry[key]: entry for entry in expected}
+    actual_by_key = {entry[key]: entry for entry in actual}
+    equal = sum(1 for k, entry in actual_by_key.items() if expected_by_key.get(k) == entry)
+    return {'expected': len(expected_by_key), 'actual': len(actual_by_key), 'equal': equal,
+            'missing': len(expected_by_key.keys() - actual_by_key.keys()),
+            'extra': len(actual_by_key.keys() - expected_by_key.keys())}
+
+def check_update(work_dir:str, commits:int, files:int, authors:int, packages:int, backend:str = 'pydriller',
+                 ratio:float = 0.2, seed:int = 0, split:float = 0.8, verbose:bool = False):
+    """Checks that analyzing the first commits and updating with the rest gives the metrics of a full run.
+
+    Both runs go through the history store, as analyze and --update do. The first
+    commits are analyzed in a clone whose HEAD is the last of them, as when the
+    repository was first mined, and the update in the repository at its final HEAD.
+    """
+    name = f'update_{commits}'
+    repo = Synthetic_Repo(os.path.join(work_dir, 'repos', name), commits, files, authors, packages, seed).create()
+    first = repo.hashes[:int(commits * split)]
+    rest = repo.hashes[len(first):]
+    first_path = os.path.join(work_dir, 'repos', f'{name}_first')
+    if os.path.exists(first_path):
+        shutil.rmtree(first_path)
+    subprocess.run(['git', 'clone', '-q', '--shared', '--no-checkout', repo.path, first_path], check=True)
+    subprocess.run(['git', '-C', first_path, 'checkout', '-q', '--detach', first[-1]], check=True)
+
+    metrics = {}
+    report = Run_Report(command='benchmark')
+    with report, pipeline_output(verbose):
+        for run in ('full', 'update'):
+            output_dir = os.path.join(work_dir, 'outputs', name, run)
+            os.makedirs(output_dir, exist_ok=True)
+            json_path = repo.make_refactoring_miner_output(os.path.join(output_dir, f'{name}_output.json'), ratio)
+            state_path = clonning_repo.get_metrics_state_path(json_path)
+            with report.stage(f'{run}_filter'):
+                filtered = clonning_repo.filter_commits_with_refactorings(json_path)
+            with History_Store(os.path.join(output_dir, f'history_{name}.sqlite')) as history:
+                history.reset()
+                history.add_refactorings(clonning_repo.iter_filtered_commits(clonning_repo.get_filtered_path(json_path)))
+                with report.stage(f'{run}_analyze'):
+                    clonning_repo.save_commit_history(filtered, first_path if run == 'update' else repo.path, json_path,
+                                                      history, first if run == 'update' else None, backend=backend,
+                                                      report=report)
+                    metrics_path = clonning_repo.get_metrics(history.iter_commits(), None, json_path, None, state_path,
+                                                             report=report, history=history)
+                if run == 'update':
+                    with report.stage('update'):
+                        start = clonning_repo.save_commit_history(filtered, repo.path, json_path, history, rest,
+                                                                  backend=backend, report=report)
+                        clonning_repo.update_metrics(history.iter_commits(start), None, metrics_path, state_path,
+                                                     report, history)
+            with open(metrics_path, 'r', encoding='utf-8') as f:
+                metrics[run] = json.load(f)['commits_metrics']
+
+    check = compare_entries(metrics['full'], metrics['update'], 'refactor_hash')
+    return {'commits': commits, 'analyzed': len(first), 'updated': len(rest), 'backend': backend,
+            'stages': get_throughput(report, commits), 'checks': {'update_metrics': check},
+            'ok': check['equal'] == check['expected'] == check['actual']}
+
+def get_commit_rows(commits):
+    # What a traversal gives of each commit, to compare backends
+    return [{'hash': c.hash, 'total_lines': c.total_lines, 'total_files': c.total_files,
+             'files': [(f.name, f.new_filepath, f.old_filepath, f.added_lines, f.deleted_lines) for f in c.files]}
+            for c in commits]
+
+def check_backends(work_dir:str, commits:int, files:int, authors:int, packages:int, ratio:float = 0.2, seed:int = 0,
+                   verbose:bool = False):
+    """Checks that the pydriller and git log traversals give the same commits and metrics.
+
+    The synthetic repository has pure renames. The git backend defines the commit
+    totals with renames detected, a renamed file counting once, so they only agree
+    with pydriller's when its commit stats detect renames too.
+    """
+    name = f'backends_{commits}'
+    repo = Synthetic_Repo(os.path.join(work_dir, 'repos', name), commits, files, authors, packages, seed).create()
+
+    rows, metrics = {}, {}
+    report = Run_Report(command='benchmark')
+    with report, pipeline_output(verbose):
+        for backend in ('pydriller', 'git'):
+            output_dir = os.path.join(work_dir, 'outputs', name, backend)
+            os.makedirs(output_dir, exist_ok=True)
+            json_path = repo.make_refactoring_miner_output(os.path.join(output_dir, f'{name}_output.json'), ratio)
+            filtered = clonning_repo.filter_commits_with_refactorings(json_path)
+            with report.stage(backend) as items:
+                ref_commits, total_commits, index = clonning_repo.save_commit_messages(filtered, repo.path, json_path,
+                                                                                      backend=backend, report=report)
+                metrics_path = clonning_repo.get_metrics(total_commits, ref_commits, json_path, index, report=report)
+                items['commits'] = len(total_commits)
+            rows[backend] = get_commit_rows(total_commits)
+            with open(metrics_path, 'r', encoding='utf-8') as f:
+                metrics[backend] = json.load(f)['commits_metrics']
+
+    renames = sum(1 for row in rows['pydriller'] if any(f[1] and f[2] and f[1] != f[2] for f in row['files']))
+    checks = {'commits': compare_entries(rows['pydriller'], rows['git'], 'hash'),
+              'metrics': compare_entries(metrics['pydriller'], metrics['git'], 'refactor_hash')}
+    return {'commits': commits, 'renames': renames, 'stages': get_throughput(report, commits), 'checks': checks,
+            'ok': renames > 0 and all(c['equal'] == c['expected'] == c['actual'] for c in checks.values())}
+
+def check_mbassador(work_dir:str, golden_dir:str = MBASSADOR_DIR, repo_path:str = None, verbose:bool = False):
+    """Checks the pipeline against the outputs committed for mbassador.
+
+    The filter runs on the committed RefactoringMiner output and the plot on the
+    committed metrics. Given a local clone of mbassador (repo_path), the traversal
+    and the metrics are recomputed and compared commit by commit too.
+    """
+    output_dir = os.path.join(work_dir, 'outputs', 'mbassador')
+    os.makedirs(output_dir, exist_ok=True)
+    json_path = os.path.join(output_dir, 'mbassador_output.json')
+    shutil.copyfile(os.path.join(golden_dir, 'mbassador_output.json'), json_path)
+    with open(os.path.join(golden_dir, 'filtered_mbassador_output.json'), 'r', encoding='utf-8') as f:
+        golden_filtered = json.load(f)['commits']
+
+    checks = {}
+    report = Run_Report(command='benchmark')
+    with report, pipeline_output(verbose):
+        if repo_path is None:
+            with report.stage('filter_commits_with_refactorings') as items:
+                filtered = clonning_repo.filter_commits_with_refactorings(json_path)
+                items['refactoring_commits'] = len(filtered)
+            with report.stage('doPlot'):
+                create_graph.doPlot(os.path.join(golden_dir, 'metrics_mbassador_output.json'),
+                                    os.path.join(output_dir, 'plot_mbassador.png'))
+        else:
+            metrics_path = run_pipeline(repo_path, json_path, report=report)
+            with open(os.path.join(golden_dir, 'ordered_msg_mbassador_output.json'), 'r', encoding='utf-8') as f:
+                golden_ordered = json.load(f)
+            checks['ordered_msg'] = compare_entries(golden_ordered, read_records(clonning_repo.get_ordered_msg_path(json_path)),
+                                                    'current_hash')
+            with open(os.path.join(golden_dir, 'metrics_mbassador_output.json'), 'r', encoding='utf-8') as f:
+                golden_metrics = json.load(f)['commits_metrics']
+            with open(metrics_path, 'r', encoding='utf-8') as f:
+                checks['metrics'] = compare_entries(golden_metrics, json.load(f)['commits_metrics'], 'refactor_hash')
+
+    filtered = list(read_records(clonning_repo.get_filtered_path(json_path)))
+    checks['filtered'] = compare_entries(golden_filtered, filtered, 'sha1')
+    commits = sum(1 for _ in iter_json_array(json_path, 'commits'))
+    return {'commits': commits, 'stages': get_throughput(report, commits), 'checks': checks,
+            'ok': all(c['equal'] == c['expected'] == c['actual'] for c in checks.values())}
+
+def print_result(title, result):
+    print(title)
+    for row in result['stages']:
+        throughput = f"{row['commits_per_s']:>10.1f} commits/s" if row['commits_per_s'] is not None else ' ' * 20
+        print(f"  {row['stage']:<34} {row['wall_s']:>9.2f}s {throughput} {row['peak_rss_mb'] or 0:>8.1f} MB")
+    for name, check in result.get('checks', {}).items():
+        print(f"  {name:<34} {check['equal']}/{check['expected']} equal, {check['missing']} missing, {check['extra']} extra")
+
+def main(scales = SCALES, files = 200, authors = 20, packages = 10, backend = 'pydriller', lean = False, ratio = 0.2,
+         seed = 0, mbassador_repo = None, work_dir = None, report_path = None, keep = False, verbose = False, artifact_format = None):
+    work_dir = os.path.abspath(work_dir or tempfile.mkdtemp(prefix='benchmark_'))
+    results = {'started_at': datetime.now(timezone.utc).isoformat(), 'scales': [], 'update': None, 'backends': None,
+               'mbassador': None}
+    try:
+        for commits in scales:
+            result = benchmark_scale(work_dir, commits, files, authors, packages, backend, lean, ratio, seed, verbose,
+                                     artifact_format)
+            print_result(f"{commits} commits, {files} files, {authors} authors, {packages} packages ({backend})", result)
+            results['scales'].append(result)
+
+        # The smallest scale is enough to catch an update that drifts from a full run
+        result = check_update(work_dir, min(scales), files, authors, packages, backend, ratio, seed, verbose=verbose)
+        print_result(f"update of the last commits of {min(scales)}: {'ok' if result['ok'] else 'DIFFERENT'}", result)
+        results['update'] = result
+
+        result = check_backends(work_dir, min(scales), files, authors, packages, ratio, seed, verbose)
+        print_result(f"pydriller and git backends on {min(scales)} commits with {result['renames']} renames: "
+                     f"{'ok' if result['ok'] else 'DIFFERENT'}", result)
+        results['backends'] = result
+
+        if os.path.exists(MBASSADOR_DIR):
+            result = check_mbassador(work_dir, MBASSADOR_DIR, mbassador_repo, verbose)
+            print_result(f"mbassador golden outputs: {'ok' if result['ok'] else 'DIFFERENT'}", result)
+            results['mbassador'] = result
+        else:
+            print(f"{MBASSADOR_DIR} not found, skipping the golden outputs check")
+    finally:
+        if not keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        else:
+            print(f"Synthetic repositories and outputs kept in {work_dir}")
+
+    if report_path:
+        os.makedirs(os.path.dirname(os.path.abspath(report_path)), exist_ok=True)
+        with open(report_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(results, separators=(',', ':')))
+            f.write('\n')
+        print(f"Benchmark report saved to {report_path}")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the mining pipeline on synthetic git repositories.")
+    parser.add_argument('--scales', type=int, nargs='+', default=list(SCALES), help="commits of each synthetic repository")
+    parser.add_argument('--files', type=int, default=200, help="maximum .java files of each repository")
+    parser.add_argument('--authors', type=int, default=20)
+    parser.add_argument('--packages', type=int, default=10, help="Java packages the files are spread over")
+    parser.add_argument('--backend', choices=['pydriller', 'git'], default='pydriller')
+    parser.add_argument('--lean', action='store_true', help="only load diffs and nloc of the refactoring commits")
+    parser.add_argument('--artifact-format', choices=['gzip', 'zstd', 'msgpack'], default=None,
+                        help="format of the ordered_msg and filtered outputs (JSON by default)")
+    parser.add_argument('--refactoring-ratio', type=float, default=0.2, help="share of the commits with refactorings")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mbassador-repo', default=None,
+                        help=f"local clone of {MBASSADOR_URL}, to also check the traversal and metrics against outputs/mbassador")
+    parser.add_argument('--work-dir', default=None, help="folder of the synthetic repositories (default: a temporary folder)")
+    parser.add_argument('--report', default=os.path.join('outputs', 'benchmark_report.jsonl'),
+                        help="JSON Lines file the results are appended to")
+    parser.add_argument('--keep', action='store_true', help="keep the synthetic repositories and their outputs")
+    parser.add_argument('--verbose', action='store_true', help="show the messages of the pipeline")
+    args = parser.parse_args()
+
+    main(args.scales, args.files, args.authors, args.packages, args.backend, args.lean, args.refactoring_ratio, args.seed,
+         args.mbassador_repo, args.work_dir, args.report, args.keep, args.verbose, args.artifact_format)
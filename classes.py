@@ -1,14 +1,28 @@
+import sys
+from bisect import bisect_left, bisect_right
+
+def _intern(value):
+    # Author names and paths repeat across the whole history, keep a single copy of each
+    return sys.intern(value) if isinstance(value, str) else value
+
 class F_File:
+    __slots__ = ('name', 'new_filepath', 'old_filepath', 'diff', 'added_lines', 'deleted_lines', 'nloc',
+                 'commit_count', 'pkg_name', 'commit_hash', 'blob_id')
+
     def __init__(self, name:str ,new_filepath:str, old_filepath:str ,diff:str, added:int,current_lines:int, deleted:int):
-        self.name = name
-        self.new_filepath = new_filepath
-        self.old_filepath = old_filepath
+        self.name = _intern(name)
+        self.new_filepath = _intern(new_filepath)
+        self.old_filepath = _intern(old_filepath)
         self.diff = diff
         self.added_lines = added
         self.deleted_lines = deleted
         self.nloc = current_lines
         self.commit_count = 0
         self.pkg_name = None
+        # Set when the file comes from numstat and its nloc is only loaded on demand
+        self.commit_hash = None
+        # New blob of the change when the traversal knows it, its package is read from it
+        self.blob_id = None
 
     def __eq__(self, other) -> bool:
         return isinstance(other, F_File) and self.name == other.name
@@ -17,7 +31,7 @@ class F_File:
         self.commit_count += count 
 
     def add_package(self, pkg_name):
-        self.pkg_name = pkg_name
+        self.pkg_name = _intern(pkg_name)
 
     def __hash__(self) -> int:
         return hash(self.name)
@@ -31,21 +45,17 @@ class F_File:
             'deleted_lines': self.deleted_lines,
             'diff_text': self.diff
         }
-    
-    def add_date(self, date):
-        self.creation_date = date
-        self.current_date = date
-    
-    def update_date(self, date):
-        self.current_date = date
 
 class F_Commit:
+    __slots__ = ('hash', 'msg', 'date', 'author', 'commiter', 'total_lines', 'total_files', 'previous_hash',
+                 'is_refactor', 'files')
+
     def __init__ (self, hash:str, msg:str, date, author:str, commiter:str, lines:int, number_files:int, is_refactor:bool = False, previous_hash:str = None):
         self.hash = hash
         self.msg = msg
         self.date = date
-        self.author = author
-        self.commiter = commiter
+        self.author = _intern(author)
+        self.commiter = _intern(commiter)
         self.total_lines = lines
         self.total_files = number_files
         self.previous_hash = previous_hash
@@ -71,6 +81,9 @@ class F_Commit:
         }
 
 class General_Metric:
+    __slots__ = ('nadev', 'ammount_adevs', 'nddev', 'ammount_ddevs', 'ncomm', 'exp', 'nf', 'la', 'ld',
+                 'cexp', 'rexp', 'nd', 'fix', 'ns')
+
     def __init__(self) -> None:
         self.nadev = 0
         self.ammount_adevs = set()
@@ -109,7 +122,11 @@ class General_Metric:
         }
 
 class File_Metric:
-    #Add metrics one by one
+    __slots__ = ('name', 'old_path', 'new_path', 'pkg_name', 'comm_count', 'ammount_adevs', 'adev_count', 'ddev_count',
+                 'add', 'deleted', 'high_contributer', 'own', 'minor', 'oexp', 'la', 'ld', 'ndev', 'nuc', 'lt', 'age',
+                 'sexp', 'entropy')
+
+    # Metrics of one file in one refactoring commit; the history of the file stays in its File_History
     def __init__(self, name:str, old_path: str, new_path:str, pkg_name:str):
         self.name = name
         self.old_path = old_path
@@ -118,19 +135,13 @@ class File_Metric:
         
         self.comm_count = 0
 
-        self.ammount_ddevs = set()
         self.ammount_adevs = set()
         self.adev_count = 0
         self.ddev_count = 0
 
-        self.added_lines = 0
-        self.deleted_lines = 0
         self.add = 0
         self.deleted = 0
 
-        self.total_lines = 0
-        self.all_devs_commits = {}
-        self.all_devs_lines = {}
         self.high_contributer :str = ''
 
         self.own = 0
@@ -144,53 +155,11 @@ class File_Metric:
         self.nuc = 0
 
         self.lt = 0
-
-        self.dates = []
-        self.days = []
         self.age = 0
 
         self.sexp = 0
         self.entropy = 0
 
-    def get_minor(self):
-        total_lines = sum(self.all_devs_commits.values())
-        self.minor = sum(1 for lines in self.all_devs_commits.values() if lines / total_lines < 0.05)
-
-    def add_adev(self, name: str):
-        self.ammount_adevs.add(name)
-        self.adev_count = len(self.ammount_adevs)
-        
-
-    def add_ddev(self, name: str):
-        self.ammount_ddevs.add(name)
-        self.ddev_count = len(self.ammount_ddevs)
-        if name in self.all_devs_commits:
-            self.all_devs_commits[name] += 1 
-        else:
-            self.all_devs_commits[name] = 1
-        self.high_contributer, _ = max(self.all_devs_commits.items(), key=lambda x: x[1])
-        self.ndev = self.adev_count
-            
-    def calc_lines(self, add:int, del_lines:int, author:str):
-        self.la = add
-        self.ld = del_lines
-        self.added_lines += add
-        self.deleted_lines += del_lines
-        if self.added_lines > 0:
-            self.add = round(add / self.added_lines, 2)
-        if self.deleted_lines > 0:
-            self.deleted = round(del_lines / self.deleted_lines, 2)
-        
-        self.total_lines += add + del_lines
-
-        self.all_devs_lines[author] = self.all_devs_lines.get(author, 0) + add + del_lines
-
-        if self.total_lines > 0:
-            self.own = round(self.all_devs_lines[self.high_contributer] / self.total_lines, 2)
-
-    def increase_comm(self):
-        self.comm_count += 1
-
     def to_dict(self):
         return{
             'new_path': self.new_path,
@@ -215,6 +184,8 @@ class File_Metric:
         }
 
 class Commit_Metric:
+    __slots__ = ('commit_hash', 'date', 'msg', 'file_metrics', 'general_metric')
+
     def __init__(self, hash, date, msg):
         self.commit_hash = hash
         self.date = date
@@ -237,3 +208,119 @@ class Commit_Metric:
     
     def __hash__(self) -> int:
         return hash(self.commit_hash)
+
+class File_History:
+    __slots__ = ('name', 'ammount_ddevs', 'all_devs_commits', 'all_devs_lines', 'added_lines', 'deleted_lines',
+                 'total_lines', 'la', 'ld', 'nuc', 'nloc', 'prev_nloc', 'last_date', 'days_sum')
+
+    # Running per-file accumulators, updated once per commit that touches the file.
+    # AGE and LT only need the touch count, the sum of the gaps between touches, the
+    # last date and the nloc before the last touch, so the state of a path stays the
+    # same size however long its history is.
+    def __init__(self, name:str):
+        self.name = name
+
+        self.ammount_ddevs = set()
+        self.all_devs_commits = {}
+        self.all_devs_lines = {}
+
+        self.added_lines = 0
+        self.deleted_lines = 0
+        self.total_lines = 0
+        self.la = 0
+        self.ld = 0
+
+        self.nuc = 0
+        self.nloc = 0
+        self.prev_nloc = 0
+
+        self.last_date = None
+        self.days_sum = 0
+
+    def touch(self, author:str, date, added:int, deleted:int, nloc):
+        self.ammount_ddevs.add(author)
+        self.all_devs_commits[author] = self.all_devs_commits.get(author, 0) + 1
+
+        self.la = added
+        self.ld = deleted
+        self.added_lines += added
+        self.deleted_lines += deleted
+        self.total_lines += added + deleted
+        self.all_devs_lines[author] = self.all_devs_lines.get(author, 0) + added + deleted
+
+        if self.last_date is not None:
+            self.days_sum += (date - self.last_date).days
+        self.last_date = date
+
+        self.nuc += 1
+        self.prev_nloc = self.nloc
+        self.nloc = nloc
+
+    def high_contributer(self):
+        name, _ = max(self.all_devs_commits.items(), key=lambda x: x[1])
+        return name
+
+    def fill_metric(self, m_file:'File_Metric'):
+        high_contributer = self.high_contributer()
+
+        m_file.ddev_count = len(self.ammount_ddevs)
+        m_file.high_contributer = high_contributer
+        m_file.la = self.la
+        m_file.ld = self.ld
+        if self.added_lines > 0:
+            m_file.add = round(self.la / self.added_lines, 2)
+        if self.deleted_lines > 0:
+            m_file.deleted = round(self.ld / self.deleted_lines, 2)
+        if self.total_lines > 0:
+            m_file.own = round(self.all_devs_lines[high_contributer] / self.total_lines, 2)
+
+        commits = sum(self.all_devs_commits.values())
+        m_file.minor = sum(1 for count in self.all_devs_commits.values() if count / commits < 0.05)
+        # OEXP needs the lines of high_contributer over the whole history, see Experience_Timeline.oexp
+        m_file.nuc = self.nuc
+        m_file.lt = self.prev_nloc
+        m_file.age = round(self.days_sum / self.nuc, 2)
+
+class Commit_Index:
+    __slots__ = ('authors', 'files', 'packages')
+
+    # Inverted indexes over the date-ordered history; postings hold commit ordinals in ascending order
+    def __init__(self):
+        self.authors = []
+        self.files = {}
+        self.packages = {}
+
+    def add_commit(self, commit:F_Commit):
+        ordinal = len(self.authors)
+        self.authors.append(commit.author)
+        for f in commit.files:
+            postings = self.files.setdefault(f.name, [])
+            if not postings or postings[-1] != ordinal:
+                postings.append(ordinal)
+            if f.pkg_name is not None:
+                self.packages.setdefault(f.pkg_name, {}).setdefault(commit.author, []).append(ordinal)
+
+    def file_commits(self, name:str, lo:int, hi:int):
+        postings = self.files.get(name, [])
+        return postings[bisect_left(postings, lo):bisect_left(postings, hi)]
+
+    def common_commits(self, names, lo:int, hi:int):
+        # Ordinals in [lo, hi) whose commit touched every file in names
+        if not names:
+            return list(range(lo, hi))
+        postings = sorted((self.files.get(name, []) for name in names), key=len)
+        result = postings[0][bisect_left(postings[0], lo):bisect_left(postings[0], hi)]
+        for other in postings[1:]:
+            if not result:
+                break
+            result = [o for o in result if _contains(other, o)]
+        return result
+
+    def package_count(self, pkg_name:str, author:str, hi:int):
+        # Files of pkg_name changed by author in commits with ordinal <= hi
+        postings = self.packages.get(pkg_name, {}).get(author, [])
+        return bisect_right(postings, hi)
+
+def _contains(postings, ordinal:int) -> bool:
+    i = bisect_left(postings, ordinal)
+    return i < len(postings) and postings[i] == ordinal
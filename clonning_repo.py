@@ -1,19 +1,42 @@
+import io
 import os
+import argparse
 import subprocess
 import sys
-import math
 import json
 import shutil
-import re
-import javalang
-from datetime import timedelta
+import pickle
+import lizard
+import lizard_languages
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime
+from pathlib import Path
 from typing import *
 from pydriller import *
 from classes import *
+from manifest import Stage_Manifest
+from mirror_store import Mirror_Store
+from metrics_engine import Metrics_Engine
+from metrics_store import Metrics_Store
+from history_store import History_Store, get_history_path
+from run_report import Run_Report, PROFILERS
+from java_packages import Package_Resolver, get_package_of_file
+from json_stream import iter_json_array, get_records_path, read_records, write_records, RECORD_FORMATS
+
+REFACTORING_MINER_VERSION = '3.0.9'
+EMPTY_TREE = '4b825dc642cb6eb9a060e54bf8d69288fbee4904'
+# Each record starts with \x1e, the message ends with \x1f and is followed by the -z raw/numstat entries
+GIT_LOG_FORMAT = '%x1e%H%x00%P%x00%an%x00%cn%x00%aI%x00%B%x1f'
+# Bump when the traversal or metric definitions change so stored stages are recomputed
+PIPELINE_VERSION = 9
+
+def get_repo_name(github_url):
+    return github_url.split('/')[-1].replace('.git', '')
 
 def clone_repo(github_url, repos_dir):
     try:
-        repo_name = github_url.split('/')[-1].replace('.git', '')
+        repo_name = get_repo_name(github_url)
         repo_path = os.path.join(repos_dir, repo_name)
 
         if os.path.exists(repo_path):
@@ -24,9 +47,9 @@ def clone_repo(github_url, repos_dir):
         return repo_path
     except subprocess.CalledProcessError as e:
         print(f"Error at clonning the repository: {e}")
-        sys.exit(1)
+        raise
 
-def run_refactoring_miner(repo_path, output_dir):
+def run_refactoring_miner(repo_path, output_dir, heap = None):
     repo_name = os.path.basename(repo_path)
 
     repo_output_dir = os.path.join(output_dir, repo_name)
@@ -39,38 +62,145 @@ def run_refactoring_miner(repo_path, output_dir):
         print(f"RefactoringMiner output already exists at: {json_output_path}")
         return json_output_path
 
-    refactoring_miner_path = r'.\RefactoringMiner-3.0.9\bin\RefactoringMiner'
+    refactoring_miner_path = rf'.\RefactoringMiner-{REFACTORING_MINER_VERSION}\bin\RefactoringMiner'
 
     test = os.path.normpath(name_file)
 
     command = f'{refactoring_miner_path} -a {repo_path} -json "{test}"'
     try:
-        subprocess.run(command,check=True, shell=True)
+        subprocess.run(command,check=True, shell=True, env=get_refactoring_miner_env(heap))
         print(f"Output saved in: {json_output_path}")
         return json_output_path
     except subprocess.CalledProcessError as e:
         print(f"Error RefactoringMiner: {e}\n")
-        sys.exit(1)
+        raise
+
+def get_refactoring_miner_env(heap = None):
+    # The RefactoringMiner launcher script passes REFACTORING_MINER_OPTS to the JVM
+    if not heap:
+        return None
+    env = dict(os.environ)
+    env['REFACTORING_MINER_OPTS'] = f"{env.get('REFACTORING_MINER_OPTS', '')} -Xmx{heap}".strip()
+    return env
+
+def run_refactoring_miner_range(repo_path, output_dir, start_commit, end_commit, heap = None):
+    # Only detects the refactorings of the commits between start_commit (excluded) and end_commit
+    repo_name = os.path.basename(repo_path)
+
+    repo_output_dir = os.path.join(output_dir, repo_name)
+    os.makedirs(repo_output_dir, exist_ok=True)
+
+    json_output_path = os.path.join(repo_output_dir, f'{repo_name}_output_{start_commit[:7]}_{end_commit[:7]}.json')
+
+    if os.path.exists(json_output_path):
+        print(f"RefactoringMiner output already exists at: {json_output_path}")
+        return json_output_path
 
-def filter_commits_with_refactorings(input_json_path):
+    refactoring_miner_path = rf'.\RefactoringMiner-{REFACTORING_MINER_VERSION}\bin\RefactoringMiner'
+
+    command = f'{refactoring_miner_path} -bc {repo_path} {start_commit} {end_commit} -json "{os.path.normpath(json_output_path)}"'
     try:
-        # Generate output path by adding 'filtered_' prefix to the original file name
-        dir_name = os.path.dirname(input_json_path)
-        base_name = os.path.basename(input_json_path)
-        output_json_path = os.path.join(dir_name, f'filtered_{base_name}')
+        subprocess.run(command,check=True, shell=True, env=get_refactoring_miner_env(heap))
+        print(f"Output saved in: {json_output_path}")
+        return json_output_path
+    except subprocess.CalledProcessError as e:
+        print(f"Error RefactoringMiner: {e}\n")
+        raise
+
+def get_shard_boundaries(repo_path, shards):
+    # Cuts the first parent chain of HEAD into shards ranges of about the same number of commits.
+    # Each range (start, end] also takes the side branches merged into it, so together they cover
+    # everything reachable from HEAD except the root commit, which has no parent to diff against.
+    result = subprocess.run(['git', '-C', repo_path, 'rev-list', '--first-parent', '--reverse', 'HEAD'],
+                            check=True, capture_output=True, text=True)
+    chain = result.stdout.split()
+    if len(chain) < 2:
+        return []
+
+    shards = max(1, min(shards, len(chain) - 1))
+    cuts = [round(i * (len(chain) - 1) / shards) for i in range(shards + 1)]
+    return [(chain[cuts[i]], chain[cuts[i + 1]]) for i in range(shards)]
+
+def merge_refactoring_miner_outputs(shard_paths, json_output_path):
+    # Streams the commits of every shard into a single file with the same layout as a -a run
+    tmp_path = json_output_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write('{"commits":[')
+        first = True
+        for shard_path in shard_paths:
+            for commit in iter_json_array(shard_path, 'commits'):
+                if not first:
+                    f.write(',')
+                f.write('\n')
+                json.dump(commit, f, ensure_ascii=False)
+                first = False
+        f.write(']}\n')
+    os.replace(tmp_path, json_output_path)
+
+def run_refactoring_miner_sharded(repo_path, output_dir, jobs, heap = None, shards = None):
+    # Runs several RefactoringMiner JVMs at once, each one over a commit range of the history,
+    # and merges their outputs into the usual <repo>_output.json. Only the commits reachable from
+    # HEAD are covered: branches that were never merged, which a -a run also walks, are left out.
+    repo_name = os.path.basename(repo_path)
+    json_output_path = os.path.join(output_dir, repo_name, f'{repo_name}_output.json')
 
-        with open(input_json_path, 'r', encoding='utf-8') as json_file:
-            data = json.load(json_file)
+    if os.path.exists(json_output_path):
+        print(f"RefactoringMiner output already exists at: {json_output_path}")
+        return json_output_path
 
-        commits_with_refactorings = [commit for commit in data['commits'] if commit['refactorings']]
-        
-        filtered_data = {
-            "commits": commits_with_refactorings
-        }
+    # More shards than JVMs so a range with heavy commits does not hold back the others
+    boundaries = get_shard_boundaries(repo_path, shards or jobs * 2)
+    # Newest range first, the order in which a -a run walks the history
+    boundaries.reverse()
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(run_refactoring_miner_range, repo_path, output_dir, start, end, heap) for start, end in boundaries]
+        # Shards already written by an interrupted run are reused by run_refactoring_miner_range
+        shard_paths = [future.result() for future in futures]
+
+    os.makedirs(os.path.dirname(json_output_path), exist_ok=True)
+    merge_refactoring_miner_outputs(shard_paths, json_output_path)
+    for shard_path in shard_paths:
+        os.remove(shard_path)
+
+    print(f"Output of {len(shard_paths)} shards merged in: {json_output_path}")
+    return json_output_path
+
+def iter_commits_with_refactorings(input_json_path):
+    # Streams over the RefactoringMiner 'commits' array instead of loading the whole file
+    for commit in iter_json_array(input_json_path, 'commits'):
+        if commit['refactorings']:
+            yield commit
+
+def get_filtered_path(input_json_path, artifact_format = None):
+    # Generate output path by adding 'filtered_' prefix to the original file name
+    dir_name = os.path.dirname(input_json_path)
+    base_name = os.path.basename(input_json_path)
+    return get_records_path(os.path.join(dir_name, f'filtered_{base_name}'), artifact_format or 'jsonl')
+
+def get_packages_path(json_path):
+    # Package cache of the repository, shared by the full analysis and the updates
+    return os.path.join(os.path.dirname(json_path), f'packages_{os.path.basename(json_path)}')
+
+def get_ordered_msg_path(json_path, artifact_format = None):
+    # Indented JSON array as always, unless a record format is asked for
+    dir_name = os.path.dirname(json_path)
+    base_name = os.path.basename(json_path)
+    output_json_path = os.path.join(dir_name, f'ordered_msg_{base_name}')
+    return get_records_path(output_json_path, artifact_format) if artifact_format else output_json_path
 
-        # Save the filtered JSON to a new file
-        with open(output_json_path, 'w', encoding='utf-8') as output_file:
-            json.dump(filtered_data, output_file, indent=4, ensure_ascii=False)
+def filter_commits_with_refactorings(input_json_path, artifact_format = None):
+    try:
+        output_json_path = get_filtered_path(input_json_path, artifact_format)
+
+        commits_with_refactorings = []
+        def keep(commits):
+            for commit in commits:
+                commits_with_refactorings.append({'sha1': commit['sha1']})
+                yield commit
+
+        # Save the filtered commits as JSON Lines (or msgpack) while reading them
+        write_records(output_json_path, keep(iter_commits_with_refactorings(input_json_path)))
 
         print(f"Filtered commits saved to {output_json_path}")
         return commits_with_refactorings
@@ -78,21 +208,129 @@ def filter_commits_with_refactorings(input_json_path):
     except Exception as e:
         print(f"Error processing the JSON file: {e}")
 
-def save_commit_messages(dict_commit, repo_path, json_path):
-    dir_name = os.path.dirname(json_path)
-    base_name = os.path.basename(json_path)
-    output_json_path = os.path.join(dir_name, f'ordered_msg_{base_name}')
+def save_commit_messages(dict_commit, repo_path, json_path, only_commits = None, workers = 1, lean = False, backend = 'pydriller',
+                         report = None, artifact_format = None):
+    output_json_path = get_ordered_msg_path(json_path, artifact_format)
 
     '''
     if os.path.exists(output_json_path):
         print(f"Ordered commit messages already exist at: {output_json_path}")
         return output_json_path
     '''
+    report = report or Run_Report()
     ref_commits = set()
     total_commits = set()
     relevant_hashes = set(commit['sha1'] for commit in dict_commit)
 
-    for c in Repository(repo_path).traverse_commits():
+    with report.stage('packages') as items:
+        packages = Package_Resolver(repo_path, get_packages_path(json_path))
+        items['java_files'] = packages.prefetch(workers, only_commits)
+    git_cmd = Git(repo_path).repo.git
+
+    if backend == 'git':
+        traversal = traverse_git_log(repo_path, relevant_hashes, git_cmd, only_commits)
+    else:
+        traversal = traverse_pydriller(repo_path, relevant_hashes, only_commits, lean)
+
+    with report.stage('walk') as items:
+        modified = 0
+        for n_commit, modified_files in traversal:
+            n_commit.add_Files(get_commit_files(packages, n_commit.hash, modified_files))
+            total_commits.add(n_commit)
+            modified += len(n_commit.files)
+
+            if n_commit.is_refactor:
+                ref_commits.add(n_commit)
+        items['commits'] = len(total_commits)
+        items['refactoring_commits'] = len(ref_commits)
+        items['modified_files'] = modified
+
+    packages.save()
+
+    ref_commits = sorted(ref_commits, key=lambda c: c.date)
+    total_commits = sorted(total_commits, key=lambda c: c.date)
+    if lean or backend == 'git':
+        with report.stage('nloc'):
+            load_missing_nloc(git_cmd, total_commits)
+
+    index = build_commit_index(total_commits)
+    
+    write_ordered_msg(output_json_path, ref_commits, artifact_format)
+    return ref_commits, total_commits, index
+
+def save_commit_history(dict_commit, repo_path, json_path, history, only_commits = None, workers = 1, backend = 'pydriller',
+                        report = None, artifact_format = None, packages_path = None):
+    """Lean traversal of save_commit_messages that writes the commits to the history store instead of returning them.
+
+    Nothing is kept in memory: the store numbers the new commits in date order,
+    loads the nloc LT needs from the blobs, and gives back the refactoring commits
+    for ordered_msg. Returns the ordinal of the first new commit. packages_path is the
+    package cache, by default the one of json_path.
+    """
+    report = report or Run_Report()
+    relevant_hashes = set(commit['sha1'] for commit in dict_commit)
+
+    with report.stage('packages') as items:
+        packages = Package_Resolver(repo_path, packages_path or get_packages_path(json_path))
+        items['java_files'] = packages.prefetch(workers, only_commits)
+    git_cmd = Git(repo_path).repo.git
+
+    if backend == 'git':
+        traversal = traverse_git_log(repo_path, relevant_hashes, git_cmd, only_commits)
+    else:
+        traversal = traverse_pydriller(repo_path, relevant_hashes, only_commits, lean=True)
+
+    with report.stage('walk') as items:
+        commits, refactoring_commits, modified = 0, 0, 0
+        for n_commit, modified_files in traversal:
+            n_commit.add_Files(get_commit_files(packages, n_commit.hash, modified_files))
+            history.add_commit(n_commit)
+            commits += 1
+            refactoring_commits += n_commit.is_refactor
+            modified += len(n_commit.files)
+        items['commits'] = commits
+        items['refactoring_commits'] = refactoring_commits
+        items['modified_files'] = modified
+
+    packages.save()
+
+    start = history.set_order()
+    with report.stage('nloc') as items:
+        items['files'] = load_stored_nloc(git_cmd, history, start)
+
+    write_ordered_msg(get_ordered_msg_path(json_path, artifact_format), history.iter_commits(start, refactor_only=True), artifact_format)
+    return start
+
+def get_commit_files(packages, commit_hash, modified_files):
+    commit_files = set()
+    for f_file in modified_files:
+        if f_file.name.endswith('.java') and f_file.new_filepath != None:
+            # The file as it is in this commit, not in the checkout
+            package_name = packages.get(commit_hash, f_file.new_filepath, f_file.blob_id)
+            if package_name != None:
+                f_file.add_package(package_name)
+
+        commit_files.add(f_file)
+    return commit_files
+
+def write_ordered_msg(output_json_path, ref_commits, artifact_format = None):
+    if artifact_format:
+        # One record per commit, serialized as it is written instead of as one document
+        write_records(output_json_path, (c.to_dict() for c in ref_commits))
+    else:
+        commits_serializable = [c.to_dict() for c in ref_commits]
+
+        with open(output_json_path, 'w', encoding='utf-8') as output_file:
+            json.dump(commits_serializable, output_file, indent=4, ensure_ascii=False)
+
+    print(f"Ordered commits saved to {output_json_path}")
+
+def to_f_files(modified_files):
+    return [F_File(f.filename, f.new_path, f.old_path ,f.diff, f.added_lines,f.nloc ,f.deleted_lines) for f in modified_files]
+
+def traverse_pydriller(repo_path, relevant_hashes, only_commits = None, lean = False):
+    git_cmd = Git(repo_path).repo.git
+    for c in Repository(repo_path, only_commits=only_commits).traverse_commits():
         value = c.hash in relevant_hashes
         n_commit = F_Commit(c.hash,
                             c.msg, 
@@ -103,208 +341,292 @@ def save_commit_messages(dict_commit, repo_path, json_path):
                             c.files, 
                             value, 
                             c.parents[0] if c.parents else None)
-        
-        commit_files = set()
-        for f in c.modified_files:
-            f_file = F_File(f.filename, f.new_path, f.old_path ,f.diff, f.added_lines,f.nloc ,f.deleted_lines)
-            
-            if f.filename.endswith('.java') and f.new_path != None:
-                file_path = os.path.join(repo_path, f.new_path)
-                normalized_path = os.path.normpath(file_path)
-                package_name = get_java_details(normalized_path)
-                if package_name != None:
-                    f_file.add_package(package_name)
-            
-            commit_files.add(f_file)
-
-        n_commit.add_Files(commit_files)
-        total_commits.add(n_commit)
-
-        if value:
-            ref_commits.add(n_commit)
-
-    ref_commits = sorted(ref_commits, key=lambda c: c.date)
-    total_commits = sorted(total_commits, key=lambda c: c.date)
-    
-    commits_serializable = [c.to_dict() for c in ref_commits]
-
-    with open(output_json_path, 'w', encoding='utf-8') as output_file:
-        json.dump(commits_serializable, output_file, indent=4, ensure_ascii=False)
-
-    print(f"Ordered commits saved to {output_json_path}")
-    return ref_commits, total_commits
-
-def get_java_details(file_path):
-    try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            java_code = file.read()
-
-        tree = javalang.parse.parse(java_code)
-        
-        package_name = tree.package
 
-        if package_name:
-            return package_name.name
+        # Lean mode only materializes diffs and nloc for refactoring commits, the rest comes from numstat
+        if value or not lean:
+            yield n_commit, to_f_files(c.modified_files)
         else:
-            return None
-
-    except FileNotFoundError:
+            yield n_commit, get_numstat_files(git_cmd, c)
+
+def traverse_git_log(repo_path, relevant_hashes, git_cmd, only_commits = None):
+    """Reads the whole history from one streamed `git log --raw --numstat`.
+
+    The commit totals are defined by this backend from the same record: the lines
+    and files of the diff against the first parent, with renames detected (-M) so a
+    renamed file counts once. Only the diffs and nloc of the refactoring commits are
+    read apart, with git_cmd.
+    """
+    for record in iter_git_log_records(repo_path, only_commits):
+        yield parse_git_log_record(record, relevant_hashes, git_cmd)
+
+def iter_git_log_records(repo_path, only_commits = None):
+    command = ['git', '-C', repo_path, 'log', '--reverse', '-z', '--no-abbrev', '--diff-merges=first-parent',
+               '--raw', '--numstat', '-M', f'--format={GIT_LOG_FORMAT}']
+    if only_commits is not None:
+        command += ['--no-walk', '--stdin']
+
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    if only_commits is not None:
+        process.stdin.write(('\n'.join(only_commits) + '\n').encode('utf-8'))
+    process.stdin.close()
+
+    # newline='' keeps the \r of CRLF commit messages, as pydriller does
+    stdout = io.TextIOWrapper(process.stdout, encoding='utf-8', errors='replace', newline='')
+    pending = ''
+    for chunk in iter(lambda: stdout.read(1 << 16), ''):
+        pending += chunk
+        records = pending.split('\x1e')
+        pending = records.pop()
+        for record in records:
+            if record:
+                yield record
+    if pending:
+        yield pending
+
+    if process.wait() != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+
+def parse_git_log_record(record, relevant_hashes, git_cmd):
+    header, _, diff = record.partition('\x1f')
+    hash, parents, author, commiter, date, msg = header.split('\0', 5)
+    parents = parents.split()
+
+    files, lines = parse_raw_numstat(diff.lstrip('\0\n').split('\0'), hash)
+    value = hash in relevant_hashes
+    n_commit = F_Commit(hash,
+                        msg.strip(),
+                        datetime.fromisoformat(date),
+                        author,
+                        commiter,
+                        lines,
+                        len(files),
+                        value,
+                        parents[0] if parents else None)
+
+    # Merge commits are diffed against their first parent for the totals, but have no modified files
+    if len(parents) > 1:
+        return n_commit, []
+    if value:
+        load_diffs(git_cmd, hash, parents[0] if parents else EMPTY_TREE, files)
+    return n_commit, files
+
+def load_diffs(git_cmd, commit_hash, parent, files):
+    # The patch lists the files in the order of the raw entries, each diff starts at its first hunk
+    # (or at the "Binary files" line) as in pydriller
+    patch = git_cmd.diff_tree(parent, commit_hash, '-r', '-M', '--full-index', '-p')
+    sections = patch.split('\ndiff --git ')
+    for f_file, section in zip(files, sections):
+        start = section.find('\n@@')
+        if start < 0:
+            start = section.find('\nBinary files ')
+        f_file.diff = section[start + 1:] + '\n' if start >= 0 else ''
+        if f_file.commit_hash is not None:
+            f_file.nloc = get_nloc(git_cmd, f_file)
+
+def get_numstat_files(git_cmd, c):
+    # Same files and line counts as pydriller's modified_files (git diff-tree -r -M), without the patch
+    if len(c.parents) > 1:
+        return []
+    parent = c.parents[0] if c.parents else EMPTY_TREE
+    tokens = git_cmd.diff_tree(parent, c.hash, '-r', '-M', '--raw', '--numstat', '-z').split('\0')
+    files, _ = parse_raw_numstat(tokens, c.hash)
+    return files
+
+def parse_raw_numstat(tokens, commit_hash):
+    # --raw entries come first and give the change type, --numstat entries follow in the same order
+    changes = []
+    i = 0
+    while i < len(tokens) and tokens[i].startswith(':'):
+        _, _, old_blob, new_blob, status = tokens[i].split()
+        # Pure renames and mode changes carry no blob in the patch, pydriller gives them no nloc
+        same_blob = old_blob == new_blob
+        if status[0] in 'RC':
+            changes.append((tokens[i + 1], tokens[i + 2], same_blob, new_blob))
+            i += 3
+        elif status[0] == 'A':
+            changes.append((None, tokens[i + 1], same_blob, new_blob))
+            i += 2
+        elif status[0] == 'D':
+            changes.append((tokens[i + 1], None, same_blob, new_blob))
+            i += 2
+        else:
+            changes.append((tokens[i + 1], tokens[i + 1], same_blob, new_blob))
+            i += 2
+
+    files = []
+    total_lines = 0
+    for old_path, new_path, same_blob, new_blob in changes:
+        added, deleted, path = tokens[i].split('\t')
+        i += 1 if path else 3
+        added = int(added) if added != '-' else 0
+        deleted = int(deleted) if deleted != '-' else 0
+        total_lines += added + deleted
+
+        # Patches without ---/+++ headers (binary or empty files being added or deleted)
+        # make GitPython report the same path on both sides
+        if old_path is None and added == 0:
+            old_path = new_path
+        elif new_path is None and deleted == 0:
+            new_path = old_path
+
+        old_path = str(Path(old_path)) if old_path else None
+        new_path = str(Path(new_path)) if new_path else None
+        f_file = F_File(Path(new_path or old_path).name, new_path, old_path, '', added, None, deleted)
+        if not same_blob:
+            f_file.commit_hash = commit_hash
+        if new_blob.strip('0'):
+            f_file.blob_id = new_blob
+        files.append(f_file)
+    return files, total_lines
+
+def load_missing_nloc(git_cmd, tot_commits):
+    # nloc is only read for LT, i.e. for the last touch of a file before a refactoring commit touching it
+    last_touch = {}
+    needed = []
+    for commit in tot_commits:
+        for f in commit.files:
+            if commit.is_refactor:
+                previous = last_touch.get(f.name)
+                if previous is not None and previous.commit_hash is not None:
+                    needed.append(previous)
+            last_touch[f.name] = f
+
+    for f in needed:
+        f.nloc = get_nloc(git_cmd, f)
+    return needed
+
+def load_stored_nloc(git_cmd, history, start = 0):
+    # Same as load_missing_nloc for the commits of the history store from ordinal start on
+    values = [(get_blob_nloc(git_cmd, commit_hash, name, new_path), rowid)
+              for rowid, commit_hash, name, new_path in history.missing_nloc(start)]
+    history.set_nloc(values)
+    return len(values)
+
+def get_nloc(git_cmd, f_file):
+    return get_blob_nloc(git_cmd, f_file.commit_hash, f_file.name, f_file.new_filepath)
+
+def get_blob_nloc(git_cmd, commit_hash, name, new_path):
+    # Mirrors pydriller's ModifiedFile.nloc
+    if new_path is None or lizard_languages.get_reader_for(name) is None:
         return None
-    except Exception as e:
+    _, _, _, content = git_cmd.get_object_data(f'{commit_hash}:{Path(new_path).as_posix()}')
+    if not content:
         return None
+    return lizard.analyze_file.analyze_source_code(name, content.decode('utf-8', 'ignore')).nloc
+
+def build_commit_index(tot_commits):
+    index = Commit_Index()
+    for commit in tot_commits:
+        index.add_commit(commit)
+    return index
+
+def get_java_details(file_path):
+    return get_package_of_file(file_path)
+
+def commit_metric_entry(commit):
+    return {
+        "refactor_hash": commit.commit_hash,
+        "refactor_msg": commit.msg,
+        "file_metrics": commit.file_metrics,
+        "general_metrics": commit.general_metric.to_dict()  # Assuming file_metrics is already structured as needed
+    }
 
-def get_metrics(tot_commits, ref_commits, json_path):
+def get_metrics(tot_commits, ref_commits, json_path, index = None, state_path = None, store_format = None, report = None,
+                history = None, head = None):
     dir_name = os.path.dirname(json_path)
     base_name = os.path.basename(json_path)
     output_json_path = os.path.join(dir_name, f'metrics_{base_name}')
+    report = report or Run_Report()
 
-    pattern = r'(Fix\w*|BugFix\w*|Bug\w*|Solv\w*)\s+#\d+'
+    engine = Metrics_Engine(index)
+    commits_list = engine.run(tot_commits, ref_commits, report)
 
-    commits_list = set()
-    i = 0
-    for c in ref_commits:
-        current_commit: Commit_Metric = Commit_Metric(c.hash, c.date, c.msg)
-        files_per_commit: Set[File_Metric] = set()
-        g_metric = General_Metric()
-        g_metric.nf = c.total_files
-        directory_list = set()
-        packages_list = set()
-
-        old_rute = []
-        new_rute = []
-
-        if re.search(pattern, c.msg,  re.IGNORECASE):
-            g_metric.fix = True
-
-        for ref_file in c.files:
-            if ref_file.pkg_name is not None:
-                packages_list.add(ref_file.pkg_name)
-
-            if ref_file.old_filepath:
-                old_rute = ref_file.old_filepath.split(os.sep)
-                directory_list.update(old_rute[:-1])
-
-            if ref_file.new_filepath:
-                new_rute = ref_file.new_filepath.split(os.sep)
-                directory_list.update(new_rute[:-1])
-            
-            m_file = File_Metric(ref_file.name, ref_file.old_filepath, ref_file.new_filepath, ref_file.pkg_name)        
-            if c.total_lines > 0:
-                m_file.entropy = round((ref_file.added_lines + ref_file.deleted_lines) / c.total_lines, 2)
-            files_per_commit.add(m_file)
-        
-        g_metric.nd = len(directory_list)
-        g_metric.ns = len(packages_list)
-        # For metric by metric
-        file_names_in_commit = {file.name for file in files_per_commit}
-        for x in range(i, len(tot_commits)):
-            if c.hash == tot_commits[x].hash:
-                i = x
-                break
-
-            files_dict = {file.name: file for file in tot_commits[x].files}
-
-            if file_names_in_commit.issubset(files_dict):
-                g_metric.ncomm += 1
-                g_metric.ammount_adevs.add(tot_commits[x].author)
-            
-            for file in files_per_commit:
-                if file.name in files_dict:
-                    file.add_adev(tot_commits[x].author)
-                    file.increase_comm()
-
-        g_metric.nadev = len(g_metric.ammount_adevs)
-
-        total_lines_by_dev = {}
-        total_commits_by_commiter = {}
-        total_dates_by_commiter = {}
-
-        # For init to current metric
-        for x in range(len(tot_commits)):
-            files_dict = {file.name: file for file in tot_commits[x].files}
-
-            commiter = tot_commits[x].commiter
-            author = tot_commits[x].author
-            total_commits_by_commiter[commiter] = total_commits_by_commiter.get(commiter, 0) + 1
-            total_dates_by_commiter.setdefault(commiter, []).append(tot_commits[x].date)
-            total_lines_by_dev[author] = total_lines_by_dev.get(author, 0) + tot_commits[x].total_lines
-
-            if file_names_in_commit.issubset(files_dict):
-                g_metric.ammount_ddevs.add(tot_commits[x].author)
-
-            for file in files_per_commit:
-                if c.author == tot_commits[x].author and file.pkg_name != None:
-                    for f_x in tot_commits[x].files:
-                        if f_x.pkg_name == file.pkg_name:
-                            file.sexp += 1
-                            
-                if file.name in files_dict:
-                    modified_file: ModifiedFile = files_dict[file.name]
-                    file.dates.append(tot_commits[x].date)
-                    
-                    if len(file.days) == 0:
-                        file.days.append(0)
-                    else:
-                        tmp = len(file.dates)
-                        days_in_btw = file.dates[tmp-1] - file.dates[tmp-2]
-                        file.days.append(days_in_btw.days)
-
-                    added_lines = modified_file.added_lines
-                    deleted_lines = modified_file.deleted_lines
-                    file.add_ddev(tot_commits[x].author)
-                    file.calc_lines(added_lines, deleted_lines, tot_commits[x].author)
-                    file.get_minor()
-
-                    file.oexp = round(total_lines_by_dev[file.high_contributer] / sum(total_lines_by_dev.values()),2)
-                    file.nuc += 1
-                    if c.hash != tot_commits[x].hash:
-                        file.lt = files_dict[file.name].nloc
-
-            if c.hash == tot_commits[x].hash:
-                break
-        
-        values = list(total_lines_by_dev.values())
+    with report.stage('save') as items:
+        commits_dict = {
+            "commits_metrics": [commit_metric_entry(commit) for commit in commits_list]
+        }
 
-        log_sum = sum(math.log(value) for value in values if value > 0)
-        g_metric.exp = round(math.exp(log_sum / len(values)), 2)
-        
-        g_metric.nddev = len(g_metric.ammount_adevs)
-        g_metric.cexp = total_commits_by_commiter[c.commiter]
+        with open(output_json_path, 'w', encoding='utf-8') as output_file:
+            json.dump(commits_dict, output_file, indent=4, ensure_ascii=False)
+        items['bytes'] = os.path.getsize(output_json_path)
 
-        dates = total_dates_by_commiter[c.commiter]
-        total_dates  = max(dates)
-        one_month_ago = total_dates  - timedelta(days=30)
-        last_month_dates = [d for d in dates if d >= one_month_ago]
-        g_metric.rexp = len(last_month_dates)
+    if store_format:
+        with report.stage('store'):
+            store_path = Metrics_Store(output_json_path, store_format).write(commits_dict["commits_metrics"])
+        print(f"Commits Metrics tables saved to {store_path}")
 
-        files_per_commit = sorted(files_per_commit, key=lambda c:c.name.lower())
+    if history is not None:
+        with report.stage('history'):
+            history.write_metrics(commits_dict["commits_metrics"])
 
-        for file in files_per_commit:
-            file.age = round(sum(file.days) / len(file.days), 2)
+    if state_path:
+        with report.stage('state'):
+            engine.head = head
+            save_metrics_state(engine, state_path)
 
-        current_commit.add_metrics(files_per_commit)
-        current_commit.general_metric = g_metric
-        commits_list.add(current_commit)
-        
+    print(f"Commits Metrics saved to {output_json_path}")
+    return output_json_path
+
+def get_missing_entries(entries, stored_hashes):
+    return [entry for entry in entries if entry['refactor_hash'] not in stored_hashes]
+
+def update_metrics(new_commits, ref_commits, metrics_json_path, state_path, report = None, history = None, head = None):
+    # Extends the accumulators saved by a previous run and appends only the new refactoring commits.
+    # head is the commit the update reaches; it is saved with the state so a rerun never feeds the same commits twice
+    report = report or Run_Report()
+    engine = load_metrics_state(state_path)
+    if head is not None and getattr(engine, 'head', None) == head:
+        print(f"The metrics at {metrics_json_path} already reach {head}")
+        return metrics_json_path
+    if history is not None:
+        # LT of the new commits may need the nloc of touches the saved state never had loaded
+        engine.load_nloc(history.last_nloc(engine.ordinal))
+    commits_list = engine.run(new_commits, ref_commits, report)
+    engine.head = head
+
+    with open(metrics_json_path, 'r', encoding='utf-8') as json_file:
+        commits_dict = json.load(json_file)
+
+    # An update that crashed before replacing the state may have written some of them already
+    new_entries = [commit_metric_entry(commit) for commit in commits_list]
+    stored_hashes = {entry['refactor_hash'] for entry in commits_dict["commits_metrics"]}
+    commits_dict["commits_metrics"].extend(get_missing_entries(new_entries, stored_hashes))
+
+    # Keep the tables written by the first run in step with the JSON
+    metrics_store = Metrics_Store.find(metrics_json_path)
+    if metrics_store is not None:
+        metrics_store.write(get_missing_entries(new_entries, metrics_store.hashes()), append=True)
+    if history is not None:
+        history.write_metrics(get_missing_entries(new_entries, history.metric_hashes()), append=True)
+
+    # The JSON and the state are only replaced once both are written, the state last
+    json_tmp_path = metrics_json_path + '.tmp'
+    with open(json_tmp_path, 'w', encoding='utf-8') as output_file:
+        json.dump(commits_dict, output_file, indent=4, ensure_ascii=False)
+    state_tmp_path = write_metrics_state(engine, state_path)
+    os.replace(json_tmp_path, metrics_json_path)
+    os.replace(state_tmp_path, state_path)
+    print(f"{len(commits_list)} new refactoring commits appended to {metrics_json_path}")
+    return metrics_json_path
 
-    commits_list = sorted(commits_list, key=lambda c: c.date)
-
-    commits_dict = {
-        "commits_metrics": [
-            {
-                "refactor_hash": commit.commit_hash,
-                "refactor_msg": commit.msg,
-                "file_metrics": commit.file_metrics,
-                "general_metrics": commit.general_metric.to_dict()  # Assuming file_metrics is already structured as needed
-            }
-            for commit in commits_list
-        ]
-    }
+def get_metrics_state_path(json_path):
+    dir_name = os.path.dirname(json_path)
+    base_name = os.path.splitext(os.path.basename(json_path))[0]
+    return os.path.join(dir_name, f'metrics_state_{base_name}.pkl')
 
-    with open(output_json_path, 'w', encoding='utf-8') as output_file:
-        json.dump(commits_dict, output_file, indent=4, ensure_ascii=False)
+def write_metrics_state(engine, state_path):
+    # Written next to state_path, for the caller to os.replace
+    tmp_path = state_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(engine, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return tmp_path
 
-    print(f"Commits Metrics saved to {output_json_path}")
+def save_metrics_state(engine, state_path):
+    os.replace(write_metrics_state(engine, state_path), state_path)
+
+def load_metrics_state(state_path):
+    with open(state_path, 'rb') as f:
+        return pickle.load(f)
 
 def delete_repo(repo_path):
     if os.path.exists(repo_path):
@@ -345,7 +667,195 @@ def delete_repo(repo_path):
         print(f"Repository path does not exist: {repo_path}")
 
 
-def main(github_url):
+def get_remote_head(github_url):
+    try:
+        result = subprocess.run(['git', 'ls-remote', github_url, 'HEAD'], check=True, capture_output=True, text=True)
+        return result.stdout.split()[0] if result.stdout else None
+    except subprocess.CalledProcessError:
+        return None
+
+def get_local_head(repo_path):
+    result = subprocess.run(['git', '-C', repo_path, 'rev-parse', 'HEAD'], check=True, capture_output=True, text=True)
+    return result.stdout.strip()
+
+def get_stage_inputs(head, metrics_store = None):
+    # Each stage depends on the fingerprint of the stage it consumes, so a stale stage invalidates everything after it
+    inputs = {'refactoring_miner': {'head': head, 'tool': f'RefactoringMiner-{REFACTORING_MINER_VERSION}'}}
+    inputs['filter'] = {'refactoring_miner': Stage_Manifest.fingerprint(inputs['refactoring_miner'])}
+    inputs['traversal'] = {'head': head, 'filter': Stage_Manifest.fingerprint(inputs['filter']), 'version': PIPELINE_VERSION}
+    inputs['metrics'] = {'traversal': Stage_Manifest.fingerprint(inputs['traversal']), 'version': PIPELINE_VERSION}
+    if metrics_store:
+        inputs['metrics']['store'] = metrics_store
+    return inputs
+
+def iter_filtered_commits(filtered_json_path):
+    # Any record format, or the filtered outputs written before the JSON Lines format
+    return read_records(filtered_json_path)
+
+def checkout_repo(github_url, repos_dir, store = None):
+    # Shared clone of the mirror; without a store, a plain clone as before
+    if store is None:
+        return clone_repo(github_url, repos_dir)
+    store.fetch(github_url)
+    return store.checkout(github_url, os.path.join(repos_dir, get_repo_name(github_url)))
+
+def release_repo(repo_path, store = None):
+    if store is None:
+        delete_repo(repo_path)
+    else:
+        store.release(repo_path)
+
+def analyze_repo(github_url, repos_dir, outputs_dir, clone_slot = None, backend = 'pydriller', rm_jobs = 1, rm_heap = None, store = None,
+                 metrics_store = None, profile = None, artifact_format = None, package_workers = 1, report = None):
+    repo_name = get_repo_name(github_url)
+    repo_output_dir = os.path.join(outputs_dir, repo_name)
+    json_path = os.path.join(repo_output_dir, f'{repo_name}_output.json')
+    manifest = Stage_Manifest(repo_output_dir)
+    history = History_Store(get_history_path(json_path))
+    report = report or Run_Report(repo_output_dir, 'analyze', profile)
+
+    with report:
+        head = get_remote_head(github_url) or manifest.head
+        inputs = get_stage_inputs(head, metrics_store)
+
+        if manifest.is_done('metrics', inputs['metrics']):
+            print(f"Metrics for {repo_name} are up to date at: {manifest.artifact('metrics')}")
+            report.skip('metrics')
+            return json_path
+
+        if manifest.is_done('traversal', inputs['traversal']):
+            print(f"Resuming {repo_name} from the stored traversal at: {manifest.artifact('traversal')}")
+            report.skip('traversal')
+        else:
+            # clone_slot is held for as long as the clone is on disk, so callers can bound disk usage
+            with clone_slot or nullcontext():
+                with report.stage('clone'):
+                    repo_path = checkout_repo(github_url, repos_dir, store)
+                try:
+                    head = get_local_head(repo_path)
+                    manifest.set_head(head)
+                    inputs = get_stage_inputs(head, metrics_store)
+
+                    if manifest.is_done('filter', inputs['filter']):
+                        report.skip('filter')
+                        ref_commits = [{'sha1': commit['sha1']} for commit in iter_filtered_commits(manifest.artifact('filter'))]
+                    else:
+                        with report.stage('refactoring_miner') as items:
+                            if manifest.is_stale('refactoring_miner', inputs['refactoring_miner']) and os.path.exists(json_path):
+                                os.remove(json_path)
+                            if rm_jobs > 1:
+                                json_path = run_refactoring_miner_sharded(repo_path, outputs_dir, rm_jobs, rm_heap)
+                            else:
+                                json_path = run_refactoring_miner(repo_path, outputs_dir, rm_heap)
+                            items['jobs'] = rm_jobs
+                            items['bytes'] = os.path.getsize(json_path) if json_path and os.path.exists(json_path) else 0
+                        manifest.complete('refactoring_miner', inputs['refactoring_miner'], json_path)
+
+                        with report.stage('filter') as items:
+                            ref_commits = filter_commits_with_refactorings(json_path, artifact_format)
+                            if ref_commits is None:
+                                raise ValueError(f"Could not filter the RefactoringMiner output at: {json_path}")
+                            items['refactoring_commits'] = len(ref_commits)
+                        manifest.complete('filter', inputs['filter'], get_filtered_path(json_path, artifact_format))
+
+                    with report.stage('traversal') as items:
+                        # The commits go to the history store as they are traversed, the metrics stage reads them back
+                        history.reset()
+                        history.add_refactorings(iter_filtered_commits(manifest.artifact('filter')))
+                        save_commit_history(ref_commits, repo_path, json_path, history, None, package_workers, backend, report, artifact_format)
+                        items['commits'] = history.count()
+                        items['refactoring_commits'] = history.count('commits', 'is_refactor = 1')
+                    manifest.complete('traversal', inputs['traversal'], history.db_path)
+                finally:
+                    # Also on failure, or the checkout stays on disk and its mirror can never be evicted
+                    with report.stage('delete'):
+                        release_repo(repo_path, store)
+
+        with report.stage('metrics') as items:
+            metrics_json_path = get_metrics(history.iter_commits(), None, json_path, None, get_metrics_state_path(json_path), metrics_store,
+                                            report, history, head)
+            items['commits'] = history.count()
+            items['refactoring_commits'] = history.count('commits', 'is_refactor = 1')
+        history.close()
+        manifest.complete('metrics', inputs['metrics'], metrics_json_path)
+        return json_path
+
+def get_new_commits(repo_path, old_head, new_head):
+    result = subprocess.run(['git', '-C', repo_path, 'rev-list', new_head, f'^{old_head}'], check=True, capture_output=True, text=True)
+    return result.stdout.split()
+
+def update_repo(github_url, repos_dir, outputs_dir, backend = 'pydriller', rm_jobs = 1, rm_heap = None, store = None,
+                metrics_store = None, profile = None, artifact_format = None, package_workers = 1):
+    # The mirror kept in the store between runs means updates only download the new objects
+    store = store or Mirror_Store()
+    repo_name = get_repo_name(github_url)
+    repo_output_dir = os.path.join(outputs_dir, repo_name)
+    json_path = os.path.join(repo_output_dir, f'{repo_name}_output.json')
+    state_path = get_metrics_state_path(json_path)
+    manifest = Stage_Manifest(repo_output_dir)
+    history = History_Store(get_history_path(json_path))
+
+    with Run_Report(repo_output_dir, 'update', profile) as report:
+        with report.stage('fetch'):
+            mirror_path = store.fetch(github_url)
+
+        metrics_inputs = manifest.stages.get('metrics', {}).get('inputs', {})
+        if (manifest.head is None or not os.path.exists(state_path) or not os.path.exists(history.db_path)
+                or metrics_inputs.get('version') != PIPELINE_VERSION):
+            # Nothing to extend yet (or the saved state predates the current classes),
+            # analyze the whole history from the mirror once
+            return analyze_repo(github_url, repos_dir, outputs_dir, backend=backend, rm_jobs=rm_jobs, rm_heap=rm_heap, store=store,
+                                metrics_store=metrics_store, artifact_format=artifact_format, package_workers=package_workers,
+                                report=report)
+
+        old_head = manifest.head
+        new_head = get_local_head(mirror_path)
+        if old_head == new_head:
+            print(f"{repo_name} has no new commits since {old_head}")
+            return json_path
+
+        new_hashes = get_new_commits(mirror_path, old_head, new_head)
+        if not new_hashes:
+            print(f"{repo_name} moved from {old_head} to {new_head} without new commits")
+            manifest.set_head(new_head)
+            return json_path
+
+        # RefactoringMiner needs a working tree
+        with report.stage('clone'):
+            repo_path = store.checkout(github_url, os.path.join(repos_dir, repo_name))
+
+        try:
+            with report.stage('refactoring_miner') as items:
+                range_json_path = run_refactoring_miner_range(repo_path, outputs_dir, old_head, new_head, rm_heap)
+                items['commits'] = len(new_hashes)
+            with report.stage('filter') as items:
+                ref_commits = filter_commits_with_refactorings(range_json_path, artifact_format)
+                if ref_commits is None:
+                    raise ValueError(f"Could not filter the RefactoringMiner output at: {range_json_path}")
+                items['refactoring_commits'] = len(ref_commits)
+
+            with report.stage('traversal') as items:
+                # Left over by an update that did not finish
+                history.discard(new_hashes)
+                history.add_refactorings(iter_filtered_commits(get_filtered_path(range_json_path, artifact_format)))
+                start = save_commit_history(ref_commits, repo_path, range_json_path, history, new_hashes, package_workers, backend, report,
+                                            artifact_format, get_packages_path(json_path))
+                items['commits'] = history.count('commits', f'ordinal >= {start}')
+                items['refactoring_commits'] = history.count('commits', f'ordinal >= {start} AND is_refactor = 1')
+        finally:
+            with report.stage('delete'):
+                store.release(repo_path)
+
+        with report.stage('metrics') as items:
+            update_metrics(history.iter_commits(start), None, manifest.artifact('metrics'), state_path, report, history, new_head)
+            items['commits'] = history.count() - start
+        history.close()
+        manifest.complete('update', {'from': old_head, 'to': new_head}, range_json_path)
+        manifest.set_head(new_head)
+        return json_path
+
+def main(github_url, update = False, backend = 'pydriller', rm_jobs = 1, rm_heap = None, store_dir = None, store_quota = None,
+         metrics_store = None, profile = None, artifact_format = None, package_workers = 1):
     # Change this to local path
     root_dir = os.getcwd()
     repos_dir = os.path.join(root_dir, 'repos')
@@ -355,22 +865,38 @@ def main(github_url):
     os.makedirs(repos_dir, exist_ok=True)
     os.makedirs(outputs_dir, exist_ok=True)
 
-    repo_path = clone_repo(github_url, repos_dir)
-
-    json_path = run_refactoring_miner(repo_path, outputs_dir)
-
-    ref_commits = filter_commits_with_refactorings(json_path)
-
-    ref_commits, tot_commits = save_commit_messages(ref_commits, repo_path, json_path)
-
-    get_metrics(tot_commits, ref_commits, json_path)
-
-    delete_repo(repo_path)
-
-if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Use: python script.py <github_url>")
+    store = Mirror_Store(store_dir, store_quota)
+    try:
+        if update:
+            update_repo(github_url, repos_dir, outputs_dir, backend, rm_jobs, rm_heap, store, metrics_store, profile, artifact_format,
+                        package_workers)
+        else:
+            analyze_repo(github_url, repos_dir, outputs_dir, backend=backend, rm_jobs=rm_jobs, rm_heap=rm_heap, store=store,
+                         metrics_store=metrics_store, profile=profile, artifact_format=artifact_format, package_workers=package_workers)
+    except subprocess.CalledProcessError:
         sys.exit(1)
 
-    github_url = sys.argv[1]
-    main(github_url)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mine the refactorings and commit metrics of a GitHub repository.")
+    parser.add_argument('github_url')
+    parser.add_argument('--update', action='store_true', help="only analyze the commits added since the last run")
+    parser.add_argument('--backend', choices=['pydriller', 'git'], default='pydriller',
+                        help="history traversal: pydriller objects or a single streamed git log")
+    parser.add_argument('--rm-jobs', type=int, default=1,
+                        help="RefactoringMiner JVMs run at once, each over a commit range of the history "
+                             "(only the commits reachable from HEAD, unlike the default run over every branch)")
+    parser.add_argument('--rm-heap', default=None, help="maximum heap of each RefactoringMiner JVM, e.g. 4g")
+    parser.add_argument('--store-dir', default=None, help="shared mirror store (defaults to $MIRROR_STORE_DIR or ~/.cache/repo_mirrors)")
+    parser.add_argument('--store-quota', default=None, help="disk quota of the mirror store, e.g. 50G; least recently used mirrors are evicted")
+    parser.add_argument('--metrics-store', choices=['sqlite', 'parquet'], default=None,
+                        help="also save the metrics as general and file metrics tables keyed by commit hash")
+    parser.add_argument('--profile', choices=PROFILERS, default=None,
+                        help="profile the whole run next to outputs/<repo>/run_report.jsonl (pyinstrument must be installed)")
+    parser.add_argument('--artifact-format', choices=[f for f in RECORD_FORMATS if f != 'jsonl'], default=None,
+                        help="write the ordered_msg and filtered outputs as gzip or zstd JSON Lines, or msgpack (needs zstandard/msgpack)")
+    parser.add_argument('--package-workers', type=int, default=1,
+                        help="processes reading the package of the .java files not in the package cache yet")
+    args = parser.parse_args()
+
+    main(args.github_url, args.update, args.backend, args.rm_jobs, args.rm_heap, args.store_dir, args.store_quota, args.metrics_store,
+         args.profile, args.artifact_format, args.package_workers)
@@ -0,0 +1,167 @@
+import numpy as np
+import pandas as pd
+from classes import F_Commit
+
+REXP_WINDOW = 30 * 24 * 60 * 60
+
+class Developer_Timeline:
+    """Prefix sums of the commits of each developer, for one developer column (author or commiter).
+
+    The rows of the history are regrouped by developer, keeping the date order inside
+    each group, next to the running line count and the dates of the developer. Any
+    (developer, ordinal) question is then one searchsorted over the whole table.
+    """
+    def __init__(self, devs, dates, lines):
+        n = len(devs)
+        order = np.argsort(devs, kind='stable')
+        self.devs = devs[order]
+        self.ordinals = order
+        self.dates = dates[order]
+        self.cum_lines = pd.Series(lines[order]).groupby(self.devs).cumsum().to_numpy()
+        self.starts = np.searchsorted(self.devs, np.arange(devs.max() + 2 if n else 1), side='left')
+
+        # Composite keys keep the developer blocks apart in a single sorted array
+        self.n = max(n, 1)
+        self.offset = dates.min() if n else 0
+        self.span = (dates.max() - self.offset if n else 0) + REXP_WINDOW + 1
+        self.ordinal_keys = self.devs * self.n + self.ordinals
+        self.date_keys = self.devs * self.span + (self.dates - self.offset)
+        # Commits appended by an update may be older than earlier ones (e.g. merged branches);
+        # the dates of these developers are not sorted, commits_since counts theirs one by one
+        backwards = (self.devs[1:] == self.devs[:-1]) & (self.dates[1:] < self.dates[:-1])
+        self.unsorted_devs = np.unique(self.devs[1:][backwards])
+
+    def position(self, devs, ordinals):
+        # Index just after the last commit of each developer up to (and including) ordinal
+        return np.searchsorted(self.ordinal_keys, devs * self.n + ordinals, side='right')
+
+    def commits(self, devs, ordinals):
+        """Commits of each developer up to and including the commit at ordinal."""
+        return self.position(devs, ordinals) - self.starts[devs]
+
+    def lines(self, devs, ordinals):
+        """Lines changed by each developer up to and including the commit at ordinal."""
+        position = self.position(devs, ordinals)
+        has_commits = position > self.starts[devs]
+        return np.where(has_commits, self.cum_lines[np.maximum(position - 1, 0)], 0)
+
+    def commits_since(self, devs, ordinals, dates):
+        """Commits of each developer up to ordinal whose date is not before the given date."""
+        position = self.position(devs, ordinals)
+        before = np.searchsorted(self.date_keys, devs * self.span + (dates - self.offset), side='left')
+        counts = np.maximum(position - np.maximum(before, self.starts[devs]), 0)
+        if len(self.unsorted_devs):
+            for i in np.flatnonzero(np.isin(devs, self.unsorted_devs)):
+                counts[i] = np.count_nonzero(self.dates[self.starts[devs[i]]:position[i]] >= dates[i])
+        return counts
+
+class Experience_Timeline:
+    """Developer experience at any commit of a date ordered history, in O(log n) per question.
+
+    Built once from a Commit_Table (see Commit_Table.timeline) and reused by the
+    metrics engine across updates: EXP, CEXP, REXP and OEXP of any ordinal.
+    """
+    def __init__(self, table:'Commit_Table'):
+        self.author_ids = dict(table.author_ids)
+        authors = np.asarray(table.authors, dtype=np.int64)
+        commiters = np.asarray(table.commiters, dtype=np.int64)
+        self.dates = np.asarray(table.dates, dtype=np.int64)
+        lines = np.asarray(table.lines, dtype=np.int64)
+        self.authors = authors
+        self.commiters = commiters
+        self.by_author = Developer_Timeline(authors, self.dates, lines)
+        self.by_commiter = Developer_Timeline(commiters, self.dates, lines)
+        self.total_lines = np.cumsum(lines)
+
+        # EXP: every commit moves the total of its author from before to after, so the
+        # sum of logs over all authors changes by log(after) - log(before); authors with
+        # no lines yet count as developers but add nothing to the sum
+        after = np.empty(len(lines), dtype=np.int64)
+        after[self.by_author.ordinals] = self.by_author.cum_lines
+        before = after - lines
+        log_after = np.log(np.where(after > 0, after, 1))
+        log_before = np.log(np.where(before > 0, before, 1))
+        self.log_sum = np.cumsum(log_after - log_before)
+        self.devs = np.cumsum(~pd.Series(authors).duplicated().to_numpy())
+
+    def __len__(self):
+        return len(self.dates)
+
+    def exp(self, ordinals):
+        """Geometric mean of the lines changed by every author seen up to each ordinal."""
+        ordinals = np.asarray(ordinals, dtype=np.int64)
+        return np.exp(self.log_sum[ordinals] / self.devs[ordinals])
+
+    def cexp(self, ordinals):
+        """Commits of the commiter of each commit so far."""
+        ordinals = np.asarray(ordinals, dtype=np.int64)
+        return self.by_commiter.commits(self.commiters[ordinals], ordinals)
+
+    def rexp(self, ordinals, window:int = REXP_WINDOW):
+        """Commits of the commiter of each commit in the window (30 days) before it."""
+        ordinals = np.asarray(ordinals, dtype=np.int64)
+        return self.by_commiter.commits_since(self.commiters[ordinals], ordinals, self.dates[ordinals] - window)
+
+    def oexp(self, authors, ordinals):
+        """Share of all the lines changed up to each ordinal that were changed by the given authors (names)."""
+        ordinals = np.asarray(ordinals, dtype=np.int64)
+        if len(ordinals) == 0:
+            return np.empty(0)
+        author_ids = np.fromiter((self.author_ids[author] for author in authors), dtype=np.int64, count=len(ordinals))
+        total = self.total_lines[ordinals]
+        lines = self.by_author.lines(author_ids, ordinals)
+        return np.divide(lines, total, out=np.zeros(len(ordinals)), where=total > 0)
+
+class Commit_Table:
+    """Columnar view of the date ordered history: one row per commit.
+
+    Authors and commiters are stored as integer ids so the experience metrics of
+    every refactoring commit can be computed at once from an Experience_Timeline
+    instead of walking per developer dictionaries.
+    """
+    def __init__(self):
+        self.author_ids = {}
+        self.commiter_ids = {}
+        self.authors = []
+        self.commiters = []
+        self.dates = []
+        self.lines = []
+        self._timeline = None
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __getstate__(self):
+        # The timeline is rebuilt on demand, do not pickle it with the engine
+        state = dict(self.__dict__)
+        state['_timeline'] = None
+        return state
+
+    def add_commit(self, commit:F_Commit):
+        self.add_row(commit.author, commit.commiter, int(commit.date.timestamp()), commit.total_lines)
+
+    def add_row(self, author:str, commiter:str, timestamp:int, lines:int):
+        self.authors.append(self.author_ids.setdefault(author, len(self.author_ids)))
+        self.commiters.append(self.commiter_ids.setdefault(commiter, len(self.commiter_ids)))
+        self.dates.append(timestamp)
+        self.lines.append(lines)
+
+    def timeline(self) -> Experience_Timeline:
+        """The Experience_Timeline of the rows so far, only rebuilt after new rows are added."""
+        if self._timeline is None or len(self._timeline) != len(self):
+            self._timeline = Experience_Timeline(self)
+        return self._timeline
+
+    def experience(self, ordinals):
+        """Returns the EXP, CEXP and REXP values of the commits at the given ordinals.
+
+        EXP is the geometric mean of the lines changed by every author seen so far,
+        CEXP the number of commits of the commiter so far and REXP how many of them
+        fall in the 30 days before the commit.
+        """
+        ordinals = np.asarray(ordinals, dtype=np.int64)
+        if len(ordinals) == 0:
+            empty = np.empty(0)
+            return empty, empty.astype(np.int64), empty.astype(np.int64)
+        timeline = self.timeline()
+        return timeline.exp(ordinals), timeline.cexp(ordinals), timeline.rexp(ordinals)
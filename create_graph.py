@@ -1,133 +1,261 @@
-import json
-import os
-import sys
-import pandas as pd
-import matplotlib.pyplot as plt
-
-#file_path="E:/OULU/Projects/sdmo_project_a/outputs/hive/metrics_hive_output.json"
-
-def doPlot(file_path):
-    folder_name = os.path.basename(os.path.dirname(file_path))
-    # Load data for processing for analysis and visualization from the minned file
-    with open(file_path,'r', encoding='utf-8') as f:
-        data = json.load(f)
-        
-    # Extract required metrics
-    refactor_commits = []
-    for commit in data['commits_metrics']:
-        refactor_commits.append(commit)
-
-    # Initialize data structure for for analysis
-    refactor_data = {
-        'commit_number':[],
-        'hash': [],
-        'message': [],
-        'EXP': [],
-        'CEXP': [],
-        'REXP': [],
-        'NADEV': [],
-        'NDDEV': [],
-        'NF': [],
-        'ADD': [],
-        'DEL': [],
-        'AGE':[],
-        'ENTROPY': []
-    }
-
-    # load required data from the commit matrcs
-    i=1
-    for commit in refactor_commits:
-        refactor_data['hash'].append(commit['refactor_hash'])
-        refactor_data['message'].append(commit['refactor_msg'])
-        refactor_data['EXP'].append(commit['general_metrics']['EXP'])
-        refactor_data['CEXP'].append(commit['general_metrics']['CEXP'])
-        refactor_data['REXP'].append(commit['general_metrics']['REXP'])
-        refactor_data['NADEV'].append(commit['general_metrics']['NADEV'])
-        refactor_data['NDDEV'].append(commit['general_metrics']['NDDEV'])
-        refactor_data['NF'].append(commit['general_metrics']['NF'])
-        refactor_data['commit_number'].append(i)
-        i+=1
-        
-        # Aggregate ADD, DEL, and average ENTROPY of files in the each commit
-        total_add, total_del, total_entropy,total_age = 0, 0, 0, 0
-        for file_metric in commit['file_metrics']:
-            total_add += file_metric['ADD']
-            total_del += file_metric['DEL']
-            total_entropy += file_metric['ENTROPY']
-            total_age +=file_metric['AGE']
-        
-        refactor_data['ADD'].append(total_add)
-        refactor_data['DEL'].append(total_del)
-        refactor_data['ENTROPY'].append(total_entropy / len(commit['file_metrics']) if commit['file_metrics'] else 0)
-        refactor_data['AGE'].append(total_age/len(commit['file_metrics']) if commit['file_metrics'] else 0)
-
-    # Convert data to DataFrame for visualization
-    df_refactor = pd.DataFrame(refactor_data)
-    #df_refactor['commit_number'] = range(1, len(df_refactor) + 1)  # Add a sequential column for plotting
-
-    # Plot selected metrics for analysis
-    fig, axes = plt.subplots(3, 2, figsize=(14, 10))
-    fig.suptitle("Evolution Across Refactoring Commits of Repository:"+folder_name)
-
-    # Experience Metrics
-    axes[0, 0].plot(df_refactor['commit_number'], df_refactor['EXP'], label='EXP')
-    axes[0, 0].set_title("Developer Experience (EXP)")
-    axes[0, 0].set_xlabel("Commit Number")
-    axes[0, 0].set_ylabel("EXP")
-
-    axes[0, 1].plot(df_refactor['commit_number'], df_refactor['CEXP'], label='CEXP')
-    axes[0, 1].set_title("Cumulative Experience (CEXP)")
-    axes[0, 1].set_xlabel("CCommit Number")
-    axes[0, 1].set_ylabel("CEXP")
-
-    # Number of Active Developers
-    #axes[1, 0].plot(df_refactor['commit_number'], df_refactor['NADEV'], label='NADEV', marker='o',color='green')
-    #axes[1, 0].set_title("Active Developers (NADEV)")
-    #axes[1, 0].set_xlabel("Commit Number")
-    #axes[1, 0].set_ylabel("NADEV")
-
-    # Average AGE
-    axes[1, 0].plot(df_refactor['commit_number'], df_refactor['AGE'], label='AGE',color='green')
-    axes[1, 0].set_title("Average age of file modified (AGE)")
-    axes[1, 0].set_xlabel("Commit Number")
-    axes[1, 0].set_ylabel("AGE")
-
-    #Number of files modified
-    axes[1, 1].plot(df_refactor['commit_number'], df_refactor['NF'], label='NF', color='purple')
-    axes[1, 1].set_title("Number of Files Modified (NF)")
-    axes[1, 1].set_xlabel("Commit Number")
-    axes[1, 1].set_ylabel("NF")
-
-    # Additions, Deletions
-    axes[2, 0].plot(df_refactor['commit_number'], df_refactor['ADD'], label='ADD', color='green')
-    axes[2, 0].plot(df_refactor['commit_number'], df_refactor['DEL'], label='DEL', color='red')
-    axes[2, 0].legend()
-    axes[2, 0].set_title("Lines Added (ADD) and Deleted (DEL)")
-    axes[2, 0].set_xlabel("Commit Number")
-    axes[2, 0].set_ylabel("Lines")
-
-    #commulative entropy
-    axes[2, 1].plot(df_refactor['commit_number'], df_refactor['ENTROPY'], label='ENTROPY', color='orange')
-    axes[2, 1].set_title("Change Entropy")
-    axes[2, 1].set_xlabel("Commit Number")
-    axes[2, 1].set_ylabel("Entropy")
-
-    plt.tight_layout(rect=[0, 0.03, 1, 0.95])
-#    plt.show()
-    plt.savefig("plot.png",dpi=300,bbox_inches='tight')
-
-def main(output_file):
-    # Check file exists
-    if os.path.exists(output_file):
-        #Plot graphs
-        doPlot(output_file)
-    else:
-        print("File does not exists")     
-
-if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Use: python script.py <metrics_file_path>")
-        sys.exit(1)
-
-    f_path = sys.argv[1]
-    main(f_path)
\ No newline at end of file
+import json
+import os
+import glob
+import argparse
+import numpy as np
+import pandas as pd
+import matplotlib
+# Figures are only saved, never shown; Agg also works in worker processes without a display
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+from metrics_store import Metrics_Store, flatten_metrics, TABLES
+from history_store import History_Store
+
+#file_path="E:/OULU/Projects/sdmo_project_a/outputs/hive/metrics_hive_output.json"
+
+# Above this many refactoring commits the curves are averaged over buckets of commits
+MAX_PLOT_POINTS = 2000
+GENERAL_PLOT_COLUMNS = ['commit_number', 'hash', 'msg', 'EXP', 'CEXP', 'REXP', 'NADEV', 'NDDEV', 'NF']
+FILE_PLOT_COLUMNS = ['commit_number', 'ADD', 'DEL', 'ENTROPY', 'AGE']
+
+def aggregate_file_metrics(files):
+    """Total ADD/DEL and average ENTROPY/AGE of the files of each refactoring commit."""
+    grouped = files.groupby('commit_number')
+    return pd.concat([grouped[['ADD', 'DEL']].sum(), grouped[['ENTROPY', 'AGE']].mean()], axis=1)
+
+def load_metric_tables(file_path):
+    """The general metrics of a metrics_<repo>_output.json and the per commit aggregates of its file metrics.
+
+    The repository's history store aggregates them in SQL; a metrics store only loads
+    the plotted columns; otherwise the JSON is parsed.
+    """
+    dir_name, base_name = os.path.split(file_path)
+    history = History_Store.find(os.path.join(dir_name, base_name[len('metrics_'):])) if base_name.startswith('metrics_') else None
+    if history is not None and history.has_table('general_metrics'):
+        columns = ', '.join(f'"{c}"' for c in GENERAL_PLOT_COLUMNS)
+        general = history.query(f'SELECT {columns} FROM general_metrics ORDER BY commit_number')
+        per_commit = history.query('SELECT commit_number, SUM("ADD") AS "ADD", SUM("DEL") AS "DEL", AVG(ENTROPY) AS ENTROPY, '
+                                   'AVG(AGE) AS AGE FROM file_metrics GROUP BY commit_number').set_index('commit_number')
+        history.close()
+        return general, per_commit
+
+    store = Metrics_Store.find(file_path)
+    if store is not None:
+        return store.read('general_metrics', GENERAL_PLOT_COLUMNS), aggregate_file_metrics(store.read('file_metrics', FILE_PLOT_COLUMNS))
+    with open(file_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    general_rows, file_rows = flatten_metrics(data['commits_metrics'])
+    return (pd.DataFrame(general_rows, columns=TABLES['general_metrics'])[GENERAL_PLOT_COLUMNS],
+            aggregate_file_metrics(pd.DataFrame(file_rows, columns=TABLES['file_metrics'])[FILE_PLOT_COLUMNS]))
+
+def get_refactor_data(general, per_commit):
+    """One row per refactoring commit with its general metrics and its file metric aggregates."""
+    refactor_data = general.rename(columns={'msg': 'message'}).set_index('commit_number')
+    # Commits without file metrics count as 0, as before
+    refactor_data = refactor_data.join(per_commit).fillna({'ADD': 0, 'DEL': 0, 'ENTROPY': 0, 'AGE': 0})
+    return refactor_data.reset_index()
+
+def downsample(df_refactor, max_points = MAX_PLOT_POINTS):
+    """Averages the metrics over max_points equal buckets of consecutive commits."""
+    if max_points is None or len(df_refactor) <= max_points:
+        return df_refactor
+    buckets = np.arange(len(df_refactor)) * max_points // len(df_refactor)
+    return df_refactor.groupby(buckets).mean(numeric_only=True)
+
+def load_refactor_data(file_path, max_points = MAX_PLOT_POINTS):
+    return downsample(get_refactor_data(*load_metric_tables(file_path)), max_points)
+
+def get_plot_path(file_path, output_dir = None, label = None):
+    # Next to the metrics file unless an output folder is given
+    folder_name = label or os.path.basename(os.path.dirname(os.path.abspath(file_path)))
+    return os.path.join(output_dir or os.path.dirname(os.path.abspath(file_path)), f"plot_{folder_name.replace('/', '_')}.png")
+
+def get_repo_name(file_path):
+    # metrics_<repo>_output.json, or the folder of any other metrics file
+    base_name = os.path.basename(file_path)
+    if base_name.startswith('metrics_') and base_name.endswith('_output.json'):
+        return base_name[len('metrics_'):-len('_output.json')]
+    return os.path.basename(os.path.dirname(os.path.abspath(file_path)))
+
+def get_repo_labels(file_paths):
+    """A distinct label per metrics file: its repository name, prefixed by as many parent folders as it takes."""
+    names = [get_repo_name(file_path) for file_path in file_paths]
+    parents = []
+    for file_path, name in zip(file_paths, names):
+        folders = [folder for folder in os.path.dirname(os.path.abspath(file_path)).split(os.sep) if folder]
+        # outputs/<repo>/metrics_<repo>_output.json, the folder adds nothing to the name
+        if folders and folders[-1] == name:
+            folders.pop()
+        parents.append(folders)
+
+    depths = [0] * len(file_paths)
+    def label(i):
+        return '/'.join(parents[i][len(parents[i]) - depths[i]:] + [names[i]])
+    while True:
+        groups = {}
+        for i in range(len(file_paths)):
+            groups.setdefault(label(i), []).append(i)
+        clashes = [group for group in groups.values() if len(group) > 1]
+        if not clashes:
+            return [label(i) for i in range(len(file_paths))]
+        grown = False
+        for group in clashes:
+            for i in group:
+                if depths[i] < len(parents[i]):
+                    depths[i] += 1
+                    grown = True
+        if not grown:
+            # The same file given twice
+            return [f'{label(i)}_{i}' for i in range(len(file_paths))]
+
+def doPlot(file_path, output_path = None, max_points = MAX_PLOT_POINTS):
+    folder_name = os.path.basename(os.path.dirname(os.path.abspath(file_path)))
+    # Load data for processing for analysis and visualization from the minned file
+    df_refactor = load_refactor_data(file_path, max_points)
+    output_path = output_path or get_plot_path(file_path)
+    plot_refactor_data(df_refactor, folder_name, output_path)
+    print(f"Plot of {folder_name} saved to {output_path}")
+    return output_path
+
+def plot_refactor_data(df_refactor, folder_name, output_path):
+    # Plot selected metrics for analysis
+    fig, axes = plt.subplots(3, 2, figsize=(14, 10))
+    fig.suptitle("Evolution Across Refactoring Commits of Repository:"+folder_name)
+
+    # Experience Metrics
+    axes[0, 0].plot(df_refactor['commit_number'], df_refactor['EXP'], label='EXP')
+    axes[0, 0].set_title("Developer Experience (EXP)")
+    axes[0, 0].set_xlabel("Commit Number")
+    axes[0, 0].set_ylabel("EXP")
+
+    axes[0, 1].plot(df_refactor['commit_number'], df_refactor['CEXP'], label='CEXP')
+    axes[0, 1].set_title("Cumulative Experience (CEXP)")
+    axes[0, 1].set_xlabel("CCommit Number")
+    axes[0, 1].set_ylabel("CEXP")
+
+    # Number of Active Developers
+    #axes[1, 0].plot(df_refactor['commit_number'], df_refactor['NADEV'], label='NADEV', marker='o',color='green')
+    #axes[1, 0].set_title("Active Developers (NADEV)")
+    #axes[1, 0].set_xlabel("Commit Number")
+    #axes[1, 0].set_ylabel("NADEV")
+
+    # Average AGE
+    axes[1, 0].plot(df_refactor['commit_number'], df_refactor['AGE'], label='AGE',color='green')
+    axes[1, 0].set_title("Average age of file modified (AGE)")
+    axes[1, 0].set_xlabel("Commit Number")
+    axes[1, 0].set_ylabel("AGE")
+
+    #Number of files modified
+    axes[1, 1].plot(df_refactor['commit_number'], df_refactor['NF'], label='NF', color='purple')
+    axes[1, 1].set_title("Number of Files Modified (NF)")
+    axes[1, 1].set_xlabel("Commit Number")
+    axes[1, 1].set_ylabel("NF")
+
+    # Additions, Deletions
+    axes[2, 0].plot(df_refactor['commit_number'], df_refactor['ADD'], label='ADD', color='green')
+    axes[2, 0].plot(df_refactor['commit_number'], df_refactor['DEL'], label='DEL', color='red')
+    axes[2, 0].legend()
+    axes[2, 0].set_title("Lines Added (ADD) and Deleted (DEL)")
+    axes[2, 0].set_xlabel("Commit Number")
+    axes[2, 0].set_ylabel("Lines")
+
+    #commulative entropy
+    axes[2, 1].plot(df_refactor['commit_number'], df_refactor['ENTROPY'], label='ENTROPY', color='orange')
+    axes[2, 1].set_title("Change Entropy")
+    axes[2, 1].set_xlabel("Commit Number")
+    axes[2, 1].set_ylabel("Entropy")
+
+    plt.tight_layout(rect=[0, 0.03, 1, 0.95])
+#    plt.show()
+    fig.savefig(output_path,dpi=300,bbox_inches='tight')
+    # Workers render many figures, do not keep them all open
+    plt.close(fig)
+
+def render_repo(file_path, output_dir = None, max_points = MAX_PLOT_POINTS, label = None):
+    """Worker task of plot_batch: plots one repository and returns its curves for the cross-repository figure."""
+    folder_name = label or get_repo_name(file_path)
+    df_refactor = get_refactor_data(*load_metric_tables(file_path))
+    # Position in the history of the repository, so repositories of any size share the x axis
+    df_refactor['progress'] = df_refactor['commit_number'] * 100 / max(len(df_refactor), 1)
+    df_refactor = downsample(df_refactor, max_points)
+    plot_refactor_data(df_refactor, folder_name, get_plot_path(file_path, output_dir, folder_name))
+    return folder_name, df_refactor[['progress', 'EXP', 'CEXP', 'AGE', 'NF', 'ADD', 'DEL', 'ENTROPY']]
+
+def plot_repos(curves, output_path):
+    """Overlays the metrics of several repositories against their progress through the refactoring commits."""
+    panels = [("Developer Experience (EXP)", 'EXP'), ("Cumulative Experience (CEXP)", 'CEXP'),
+              ("Average age of file modified (AGE)", 'AGE'), ("Number of Files Modified (NF)", 'NF'),
+              ("Lines Changed (ADD + DEL)", None), ("Change Entropy", 'ENTROPY')]
+    fig, axes = plt.subplots(3, 2, figsize=(14, 10))
+    fig.suptitle(f"Evolution Across Refactoring Commits of {len(curves)} Repositories")
+    for ax, (title, column) in zip(axes.flat, panels):
+        for folder_name, df_refactor in curves:
+            values = df_refactor['ADD'] + df_refactor['DEL'] if column is None else df_refactor[column]
+            ax.plot(df_refactor['progress'], values, label=folder_name, linewidth=0.8)
+        ax.set_title(title)
+        ax.set_xlabel("Refactoring Commits (% of history)")
+        ax.set_ylabel(column or "Lines")
+    # Legend once, a dozen repositories would hide the curves of every panel
+    axes[0, 0].legend(fontsize='small')
+    plt.tight_layout(rect=[0, 0.03, 1, 0.95])
+    fig.savefig(output_path, dpi=300, bbox_inches='tight')
+    plt.close(fig)
+    return output_path
+
+def plot_batch(file_paths, output_dir, workers = None, max_points = MAX_PLOT_POINTS):
+    """Plots every repository, then all of them together in plot_all_repos.png, in worker processes.
+
+    Repositories with the same name in different folders get the folders in their label and figure name.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    curves = []
+    labels = get_repo_labels(file_paths)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(render_repo, file_path, output_dir, max_points, label): (file_path, label)
+                   for file_path, label in zip(file_paths, labels)}
+        for future, (file_path, label) in futures.items():
+            try:
+                curves.append(future.result())
+                print(f"Plot of {label} saved to {get_plot_path(file_path, output_dir, label)}")
+            except Exception as e:
+                print(f"Could not plot {file_path}: {e}")
+        if not curves:
+            return None
+        output_path = pool.submit(plot_repos, curves, os.path.join(output_dir, 'plot_all_repos.png')).result()
+    print(f"Plot of {len(curves)} repositories saved to {output_path}")
+    return output_path
+
+def find_metrics_files(paths):
+    # A folder stands for every metrics_<repo>_output.json below it, e.g. outputs/
+    file_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            file_paths.extend(sorted(glob.glob(os.path.join(path, '**', 'metrics_*_output.json'), recursive=True)))
+        elif os.path.exists(path):
+            file_paths.append(path)
+        else:
+            print(f"File {path} does not exists")
+    return file_paths
+
+def main(paths, output_dir = None, workers = None, max_points = MAX_PLOT_POINTS):
+    file_paths = find_metrics_files(paths)
+    if not file_paths:
+        print("File does not exists")
+    elif len(file_paths) == 1:
+        #Plot graphs
+        doPlot(file_paths[0], get_plot_path(file_paths[0], output_dir), max_points)
+    else:
+        plot_batch(file_paths, output_dir or 'plots', workers, max_points)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plot the metrics of the refactoring commits of one or more repositories.")
+    parser.add_argument('paths', nargs='+', help="metrics_<repo>_output.json files, or folders to search for them")
+    parser.add_argument('--output-dir', default=None,
+                        help="folder of the figures; defaults to the folder of the metrics file, or ./plots for several repositories")
+    parser.add_argument('--workers', type=int, default=None, help="processes rendering figures at once (default: one per CPU)")
+    parser.add_argument('--max-points', type=int, default=MAX_PLOT_POINTS,
+                        help="refactoring commits plotted per repository before averaging them in buckets")
+    args = parser.parse_args()
+
+    main(args.paths, args.output_dir, args.workers, args.max_points)
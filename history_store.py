@@ -0,0 +1,269 @@
+import os
+import json
+import sqlite3
+import pandas as pd
+from datetime import datetime
+from classes import F_Commit, F_File
+from metrics_store import TABLES, flatten_metrics, write_sqlite_tables
+
+# Commits buffered before each executemany
+BATCH_SIZE = 1000
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS commits (
+    id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL UNIQUE,
+    ordinal INTEGER,
+    previous_hash TEXT,
+    author TEXT,
+    commiter TEXT,
+    date TEXT,
+    timestamp REAL,
+    msg TEXT,
+    total_lines INTEGER,
+    total_files INTEGER,
+    is_refactor INTEGER
+);
+CREATE INDEX IF NOT EXISTS commits_ordinal ON commits (ordinal);
+CREATE INDEX IF NOT EXISTS commits_author ON commits (author);
+CREATE INDEX IF NOT EXISTS commits_timestamp ON commits (timestamp);
+CREATE TABLE IF NOT EXISTS file_changes (
+    commit_id INTEGER NOT NULL REFERENCES commits (id),
+    hash TEXT NOT NULL,
+    name TEXT,
+    old_path TEXT,
+    new_path TEXT,
+    pkg_name TEXT,
+    added_lines INTEGER,
+    deleted_lines INTEGER,
+    nloc INTEGER,
+    lazy_nloc INTEGER,
+    diff TEXT
+);
+CREATE INDEX IF NOT EXISTS file_changes_commit ON file_changes (commit_id);
+CREATE INDEX IF NOT EXISTS file_changes_hash ON file_changes (hash, name);
+CREATE INDEX IF NOT EXISTS file_changes_path ON file_changes (new_path);
+CREATE TABLE IF NOT EXISTS refactorings (
+    hash TEXT NOT NULL,
+    type TEXT,
+    description TEXT,
+    left_side TEXT,
+    right_side TEXT
+);
+CREATE INDEX IF NOT EXISTS refactorings_hash ON refactorings (hash);
+CREATE INDEX IF NOT EXISTS refactorings_type ON refactorings (type);
+'''
+
+def get_history_path(json_path):
+    # outputs/<repo>/<repo>_output.json -> outputs/<repo>/history_<repo>_output.sqlite
+    dir_name = os.path.dirname(json_path)
+    base_name = os.path.splitext(os.path.basename(json_path))[0]
+    return os.path.join(dir_name, f'history_{base_name}.sqlite')
+
+class History_Store:
+    """SQLite database of everything mined from one repository.
+
+    commits and file_changes are written in batches during the traversal, numbered
+    in date order by set_order and read back in that order by iter_commits, so no
+    stage keeps the history in memory. lazy_nloc marks the file changes whose nloc
+    was not read during the traversal but can be from their blob (see missing_nloc). refactorings holds the RefactoringMiner
+    output of the refactoring commits, and general_metrics and file_metrics (same
+    columns as Metrics_Store) the computed metrics. Every table is indexed on the
+    commit hash; commits also on author and date, file changes on path.
+    """
+    def __init__(self, db_path:str, batch_size:int = BATCH_SIZE):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.connection = None
+        self.pending = []
+
+    @classmethod
+    def find(cls, json_path:str):
+        """The store of the repository whose RefactoringMiner output is json_path, or None."""
+        store = cls(get_history_path(json_path))
+        return store if os.path.exists(store.db_path) else None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.flush()
+        self.close()
+        return False
+
+    def open(self):
+        if self.connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            self.connection = sqlite3.connect(self.db_path)
+            # One writer per repository, a crash only loses the uncommitted batch
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.executescript(SCHEMA)
+        return self.connection
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def reset(self):
+        """Drops everything stored so far, before a new traversal of the whole history."""
+        self.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.remove(self.db_path + suffix)
+
+    def add_refactorings(self, commits):
+        """Stores the refactorings of the RefactoringMiner commits (as in filtered_<repo>_output.jsonl), one row per refactoring."""
+        connection = self.open()
+        rows = []
+        for commit in commits:
+            for refactoring in commit['refactorings']:
+                rows.append((commit['sha1'], refactoring.get('type'), refactoring.get('description'),
+                             json.dumps(refactoring.get('leftSideLocations', [])),
+                             json.dumps(refactoring.get('rightSideLocations', []))))
+                if len(rows) >= self.batch_size:
+                    connection.executemany('INSERT INTO refactorings VALUES (?, ?, ?, ?, ?)', rows)
+                    rows = []
+        connection.executemany('INSERT INTO refactorings VALUES (?, ?, ?, ?, ?)', rows)
+        connection.commit()
+
+    def add_commit(self, commit:F_Commit):
+        """Buffers a traversed commit with its files; written every batch_size commits."""
+        self.pending.append(commit)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        connection = self.open()
+        # Ids are given here rather than by SQLite so both tables are written with executemany
+        first_id = connection.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM commits').fetchone()[0]
+        commit_rows, file_rows = [], []
+        for commit_id, commit in enumerate(self.pending, first_id):
+            commit_rows.append((commit_id, commit.hash, None, commit.previous_hash, commit.author, commit.commiter, commit.date.isoformat(),
+                                commit.date.timestamp(), commit.msg, commit.total_lines, commit.total_files, int(commit.is_refactor)))
+            # Diffs are only kept for the refactoring commits, as in ordered_msg_<repo>_output.json
+            for f in commit.files:
+                file_rows.append((commit_id, commit.hash, f.name, f.old_filepath, f.new_filepath, f.pkg_name,
+                                  f.added_lines, f.deleted_lines, f.nloc, int(f.commit_hash is not None),
+                                  f.diff if commit.is_refactor else None))
+        connection.executemany('INSERT INTO commits VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', commit_rows)
+        connection.executemany('INSERT INTO file_changes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', file_rows)
+        connection.commit()
+        self.pending = []
+
+    def discard(self, hashes):
+        """Removes the given commits, e.g. left over by an update that did not finish."""
+        self.flush()
+        connection = self.open()
+        with connection:
+            for table in ('file_changes', 'refactorings', 'commits'):
+                connection.executemany(f'DELETE FROM {table} WHERE hash = ?', ((h,) for h in hashes))
+
+    def set_order(self):
+        """Numbers the commits added since the last call in date order (traversal order for equal dates),
+        after the ones already ordered, and returns the first new ordinal."""
+        self.flush()
+        connection = self.open()
+        start = connection.execute('SELECT COALESCE(MAX(ordinal) + 1, 0) FROM commits').fetchone()[0]
+        ids = connection.execute('SELECT id FROM commits WHERE ordinal IS NULL ORDER BY timestamp, id').fetchall()
+        connection.executemany('UPDATE commits SET ordinal = ? WHERE id = ?',
+                               ((ordinal, commit_id) for ordinal, (commit_id,) in enumerate(ids, start)))
+        connection.commit()
+        return start
+
+    def missing_nloc(self, start:int = 0):
+        """(rowid, hash, name, new_path) of the file changes whose nloc LT needs and that are not loaded yet.
+
+        LT of a file in a refactoring commit is the nloc of the last earlier commit
+        touching a file of the same name (the last one of that commit, as fed to
+        File_History). Only the refactoring commits from ordinal start on are looked
+        at, but their previous touches may be in any earlier commit.
+        """
+        self.flush()
+        return self.open().execute(
+            'WITH touches AS (SELECT f.name, c.ordinal, c.is_refactor, MAX(f.rowid) AS id '
+            'FROM file_changes f JOIN commits c ON c.id = f.commit_id WHERE c.ordinal IS NOT NULL GROUP BY f.name, c.ordinal), '
+            'previous AS (SELECT ordinal, is_refactor, LAG(id) OVER (PARTITION BY name ORDER BY ordinal) AS id FROM touches) '
+            'SELECT DISTINCT f.rowid, f.hash, f.name, f.new_path FROM previous p JOIN file_changes f ON f.rowid = p.id '
+            'WHERE p.is_refactor = 1 AND p.ordinal >= ? AND f.nloc IS NULL AND f.lazy_nloc = 1', (start,)).fetchall()
+
+    def set_nloc(self, values):
+        """Stores the (nloc, rowid) pairs loaded for the rows of missing_nloc."""
+        connection = self.open()
+        connection.executemany('UPDATE file_changes SET nloc = ?, lazy_nloc = 0 WHERE rowid = ?', values)
+        connection.commit()
+
+    def last_nloc(self, before:int):
+        """(name, nloc) of the last touch of each file name before ordinal before, when its nloc is loaded.
+
+        A saved Metrics_Engine keeps None for the touches whose nloc was only loaded
+        later, by missing_nloc, for the LT of newer refactoring commits.
+        """
+        self.flush()
+        return self.open().execute(
+            'WITH touches AS (SELECT f.name, MAX(c.ordinal) AS ordinal FROM file_changes f JOIN commits c ON c.id = f.commit_id '
+            'WHERE c.ordinal < ? GROUP BY f.name), '
+            'last AS (SELECT MAX(f.rowid) AS id FROM touches t JOIN commits c ON c.ordinal = t.ordinal '
+            'JOIN file_changes f ON f.commit_id = c.id AND f.name = t.name GROUP BY t.name) '
+            'SELECT f.name, f.nloc FROM last l JOIN file_changes f ON f.rowid = l.id WHERE f.nloc IS NOT NULL',
+            (before,)).fetchall()
+
+    def iter_commits(self, start:int = 0, refactor_only:bool = False):
+        """Yields the stored commits from ordinal start on, in date order, as F_Commit with their files."""
+        self.flush()
+        cursor = self.open().execute(
+            'SELECT c.id, c.hash, c.msg, c.date, c.author, c.commiter, c.total_lines, c.total_files, c.is_refactor, c.previous_hash, '
+            'f.name, f.new_path, f.old_path, f.diff, f.added_lines, f.nloc, f.deleted_lines, f.pkg_name '
+            'FROM commits c LEFT JOIN file_changes f ON f.commit_id = c.id '
+            'WHERE c.ordinal >= ?' + (' AND c.is_refactor = 1' if refactor_only else '') + ' ORDER BY c.ordinal, f.rowid', (start,))
+        commit, commit_id, files = None, None, []
+        while rows := cursor.fetchmany(self.batch_size):
+            for row in rows:
+                if row[0] != commit_id:
+                    if commit is not None:
+                        commit.add_Files(files)
+                        yield commit
+                    commit_id, files = row[0], []
+                    commit = F_Commit(row[1], row[2], datetime.fromisoformat(row[3]), row[4], row[5], row[6], row[7],
+                                      bool(row[8]), row[9])
+                if row[10] is not None:
+                    f_file = F_File(row[10], row[11], row[12], row[13], row[14], row[15], row[16])
+                    if row[17] is not None:
+                        f_file.add_package(row[17])
+                    files.append(f_file)
+        if commit is not None:
+            commit.add_Files(files)
+            yield commit
+
+    def count(self, table:str = 'commits', where:str = None):
+        connection = self.open()
+        return connection.execute(f'SELECT COUNT(*) FROM {table}' + (f' WHERE {where}' if where else '')).fetchone()[0]
+
+    def has_table(self, table:str) -> bool:
+        return self.open().execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+
+    def metric_hashes(self):
+        """Hashes of the commits whose metrics are stored."""
+        if not self.has_table('general_metrics'):
+            return set()
+        return {commit_hash for (commit_hash,) in self.open().execute('SELECT hash FROM general_metrics')}
+
+    def write_metrics(self, entries, append:bool = False):
+        """Stores the commit metric entries (as in metrics_*.json) in the general_metrics and file_metrics tables."""
+        connection = self.open()
+        if not append:
+            for table in TABLES:
+                connection.execute(f'DROP TABLE IF EXISTS {table}')
+        first_number = self.count('general_metrics') + 1 if append and self.has_table('general_metrics') else 1
+        with connection:
+            write_sqlite_tables(connection, dict(zip(TABLES, flatten_metrics(entries, first_number))))
+
+    def query(self, sql:str, params = ()):
+        """Runs any SELECT on the store and returns a DataFrame."""
+        self.flush()
+        return pd.read_sql_query(sql, self.open(), params=params)
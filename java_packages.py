@@ -0,0 +1,153 @@
+import os
+import json
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from javalang import tokenizer
+
+def read_package_name(java_code):
+    """Returns the package declared in java_code, tokenizing only the file header."""
+    try:
+        tokens = tokenizer.tokenize(java_code)
+        depth = 0
+        for token in tokens:
+            # Package annotations may carry arguments such as Foo.class
+            if isinstance(token, tokenizer.Separator) and token.value in '()':
+                depth += 1 if token.value == '(' else -1
+                continue
+            if depth > 0 or isinstance(token, (tokenizer.Annotation, tokenizer.Identifier)) or token.value == '.':
+                continue
+
+            if isinstance(token, tokenizer.Keyword) and token.value == 'package':
+                parts = []
+                for token in tokens:
+                    if token.value == ';':
+                        return ''.join(parts)
+                    parts.append(token.value)
+            # Anything else (import, class, modifiers...) means there is no package declaration
+            return None
+    except Exception:
+        return None
+    return None
+
+def get_package_of_file(file_path):
+    try:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            return read_package_name(file.read())
+    except (OSError, UnicodeDecodeError):
+        return None
+
+def get_package_of_blob(content:bytes):
+    try:
+        return read_package_name(content.decode('utf-8'))
+    except UnicodeDecodeError:
+        return None
+
+class Package_Resolver:
+    """Resolves the package of the .java files of each commit, memoized by blob id.
+
+    The package of a file is read from its own version in the commit being traversed
+    (the new blob of the change), streamed by `git cat-file --batch` instead of read
+    from the checkout. Each blob is only tokenized once and the results are kept in
+    an on-disk cache shared by later runs of the same repository.
+    """
+    def __init__(self, repo_path:str, cache_path:str = None):
+        self.repo_path = repo_path
+        self.cache_path = cache_path
+        self.cache = {}
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                self.cache = json.load(f)
+        self.lookup = None
+        self.reader = None
+
+    def git_batch(self, option:str):
+        return subprocess.Popen(['git', '-C', self.repo_path, 'cat-file', option],
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def blob_id(self, commit_hash:str, path:str):
+        """The blob of path in commit_hash, or None when the commit has no such file."""
+        if self.lookup is None:
+            self.lookup = self.git_batch('--batch-check')
+        self.lookup.stdin.write(f"{commit_hash}:{path.replace(os.sep, '/')}\n".encode('utf-8'))
+        self.lookup.stdin.flush()
+        header = self.lookup.stdout.readline().decode('utf-8').split()
+        return header[0] if len(header) == 3 and header[1] == 'blob' else None
+
+    def read_blob(self, blob_id:str) -> bytes:
+        if self.reader is None:
+            self.reader = self.git_batch('--batch')
+        self.reader.stdin.write(f'{blob_id}\n'.encode('ascii'))
+        self.reader.stdin.flush()
+        header = self.reader.stdout.readline().split()
+        if len(header) != 3:
+            return b''
+        content = self.reader.stdout.read(int(header[2]))
+        # Each object is followed by a newline
+        self.reader.stdout.read(1)
+        return content
+
+    def list_java_blobs(self, only_commits = None):
+        """Blob ids of the .java files added or changed by the commits (every commit by default)."""
+        if only_commits is not None and not only_commits:
+            return set()
+        command = ['git', '-C', self.repo_path, 'log', '--format=', '--raw', '-z', '--no-abbrev', '--no-renames']
+        if only_commits is not None:
+            command += ['--no-walk', '--stdin']
+        result = subprocess.run(command, input='\n'.join(only_commits or []), check=True, capture_output=True,
+                                text=True, encoding='utf-8', errors='surrogateescape')
+        tokens = result.stdout.split('\0')
+        blobs = set()
+        i = 0
+        while i < len(tokens):
+            info = tokens[i].lstrip('\n')
+            if not info.startswith(':'):
+                i += 1
+                continue
+            # Without renames each entry is the mode, blobs and status followed by one path
+            new_blob, path = info.split()[3], tokens[i + 1]
+            if path.endswith('.java') and new_blob.strip('0'):
+                blobs.add(new_blob)
+            i += 2
+        return blobs
+
+    def prefetch(self, workers:int = 1, only_commits = None, chunk_size:int = 1024):
+        """Resolves every blob of the commits missing from the cache, in a pool of worker processes when workers > 1.
+
+        Returns the number of .java blobs of the commits.
+        """
+        blobs = self.list_java_blobs(only_commits)
+        missing = [blob_id for blob_id in blobs if blob_id not in self.cache]
+        pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 and missing else None
+        try:
+            for i in range(0, len(missing), chunk_size):
+                chunk = missing[i:i + chunk_size]
+                contents = [self.read_blob(blob_id) for blob_id in chunk]
+                packages = pool.map(get_package_of_blob, contents, chunksize=64) if pool else map(get_package_of_blob, contents)
+                self.cache.update(zip(chunk, packages))
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        return len(blobs)
+
+    def get(self, commit_hash:str, path:str, blob_id:str = None):
+        """Package of the version of path in commit_hash, whose blob id is looked up when not given."""
+        blob_id = blob_id or self.blob_id(commit_hash, path)
+        if blob_id is None:
+            return None
+        if blob_id not in self.cache:
+            self.cache[blob_id] = get_package_of_blob(self.read_blob(blob_id))
+        return self.cache[blob_id]
+
+    def close(self):
+        for process in (self.lookup, self.reader):
+            if process is not None:
+                process.stdin.close()
+                process.wait()
+        self.lookup = self.reader = None
+
+    def save(self):
+        self.close()
+        if not self.cache_path:
+            return
+        with open(self.cache_path, 'w', encoding='utf-8') as f:
+            json.dump(self.cache, f)
@@ -0,0 +1,149 @@
+import os
+import gzip
+import json
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+CHUNK_SIZE = 1 << 20
+WHITESPACE = ' \t\n\r'
+GZIP_LEVEL = 6
+# Record formats of the ordered_msg and filtered outputs, by file extension
+RECORD_FORMATS = {'jsonl': '.jsonl', 'gzip': '.jsonl.gz', 'zstd': '.jsonl.zst', 'msgpack': '.msgpack'}
+
+def iter_json_array(file_path, key, chunk_size = CHUNK_SIZE):
+    """Yields the elements of the top level array stored under key, one at a time.
+
+    Only the current element and one read chunk are kept in memory, so the size
+    of the file does not matter.
+    """
+    decoder = json.JSONDecoder()
+    with open(file_path, 'r', encoding='utf-8') as f:
+        buffer = f.read(chunk_size)
+        eof = not buffer
+
+        # Find the opening bracket of the array
+        marker = json.dumps(key)
+        while True:
+            start = buffer.find(marker)
+            if start != -1:
+                bracket = buffer.find('[', start + len(marker))
+                if bracket != -1:
+                    pos = bracket + 1
+                    break
+            if eof:
+                raise ValueError(f"No '{key}' array found in {file_path}")
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buffer += chunk
+
+        read_size = chunk_size
+        while True:
+            # Skip separators between elements
+            while True:
+                while pos < len(buffer) and (buffer[pos] in WHITESPACE or buffer[pos] == ','):
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    break
+                buffer, pos = f.read(chunk_size), 0
+                eof = not buffer
+
+            if pos >= len(buffer):
+                raise ValueError(f"Unterminated '{key}' array in {file_path}")
+            if buffer[pos] == ']':
+                return
+
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+                # A number or literal touching the end of the buffer may still go on
+                complete = end < len(buffer) or eof
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                complete = False
+
+            if not complete:
+                # The element continues in the next chunk; read more, growing the read size
+                # so a very large element is not decoded again and again
+                chunk = f.read(read_size)
+                eof = not chunk
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                read_size *= 2
+                continue
+
+            read_size = chunk_size
+            yield element
+            pos = end
+
+def get_records_path(file_path, record_format):
+    """file_path with the extension of record_format, e.g. ordered_msg_<repo>_output.jsonl.zst for zstd."""
+    if record_format not in RECORD_FORMATS:
+        raise ValueError(f"Unknown record format: {record_format}")
+    base_path = file_path
+    for extension in sorted(RECORD_FORMATS.values(), key=len, reverse=True) + ['.json']:
+        if base_path.endswith(extension):
+            base_path = base_path[:-len(extension)]
+            break
+    return base_path + RECORD_FORMATS[record_format]
+
+def open_text(file_path, mode = 'r'):
+    # JSON Lines are compressed on the fly when the name ends with .gz or .zst
+    if file_path.endswith('.gz'):
+        return gzip.open(file_path, mode + 't', encoding='utf-8', compresslevel=GZIP_LEVEL)
+    if file_path.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError(f"zstandard is needed to read or write {file_path}")
+        return zstandard.open(file_path, mode + 't', encoding='utf-8')
+    return open(file_path, mode, encoding='utf-8')
+
+def write_json_lines(file_path, items):
+    """Writes one compact JSON document per line and returns how many were written."""
+    count = 0
+    with open_text(file_path, 'w') as f:
+        for item in items:
+            f.write(json.dumps(item, ensure_ascii=False, separators=(',', ':')))
+            f.write('\n')
+            count += 1
+    return count
+
+def read_json_lines(file_path):
+    with open_text(file_path, 'r') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def write_records(file_path, items):
+    """Writes items one at a time as JSON Lines (compressed for .gz/.zst) or msgpack, by extension; returns how many."""
+    if not file_path.endswith('.msgpack'):
+        return write_json_lines(file_path, items)
+    if msgpack is None:
+        raise ImportError(f"msgpack is needed to write {file_path}")
+    count = 0
+    packer = msgpack.Packer(use_bin_type=True)
+    with open(file_path, 'wb') as f:
+        for item in items:
+            f.write(packer.pack(item))
+            count += 1
+    return count
+
+def read_records(file_path):
+    """Yields the items of a file written by write_records, or of a JSON array (or {"commits": [...]}) file."""
+    if file_path.endswith('.msgpack'):
+        if msgpack is None:
+            raise ImportError(f"msgpack is needed to read {file_path}")
+        with open(file_path, 'rb') as f:
+            yield from msgpack.Unpacker(f, raw=False)
+    elif os.path.splitext(file_path)[1] == '.json':
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        yield from data['commits'] if isinstance(data, dict) else data
+    else:
+        yield from read_json_lines(file_path)
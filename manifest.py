@@ -0,0 +1,55 @@
+import os
+import json
+import hashlib
+from datetime import datetime, timezone
+
+class Stage_Manifest:
+    """Records the completed pipeline stages of one repository in outputs/<repo>/manifest.json."""
+    def __init__(self, repo_output_dir:str):
+        self.path = os.path.join(repo_output_dir, 'manifest.json')
+        self.stages = {}
+        self.head = None
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.stages = data.get('stages', {})
+            self.head = data.get('head')
+
+    @staticmethod
+    def fingerprint(inputs:dict) -> str:
+        return hashlib.sha1(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def is_done(self, stage:str, inputs:dict) -> bool:
+        """A stage is valid when it was completed with the same inputs and its artifact still exists."""
+        record = self.stages.get(stage)
+        if record is None or record['fingerprint'] != self.fingerprint(inputs):
+            return False
+        return record['artifact'] is None or os.path.exists(record['artifact'])
+
+    def is_stale(self, stage:str, inputs:dict) -> bool:
+        """A stage is stale when it was completed before but with different inputs."""
+        return stage in self.stages and not self.is_done(stage, inputs)
+
+    def artifact(self, stage:str):
+        return self.stages[stage]['artifact']
+
+    def complete(self, stage:str, inputs:dict, artifact:str = None):
+        self.stages[stage] = {
+            'inputs': inputs,
+            'fingerprint': self.fingerprint(inputs),
+            'artifact': artifact,
+            'completed_at': datetime.now(timezone.utc).isoformat()
+        }
+        self.save()
+
+    def set_head(self, head:str):
+        self.head = head
+        self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'head': self.head, 'stages': self.stages}, f, indent=4)
+        # Atomic so a crash never leaves a half written manifest behind
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,147 @@
+import os
+import re
+from typing import *
+from classes import *
+from commit_table import Commit_Table
+from run_report import Run_Report
+
+FIX_PATTERN = r'(Fix\w*|BugFix\w*|Bug\w*|Solv\w*)\s+#\d+'
+
+class Metrics_Engine:
+    # Walks the date ordered history once, keeping running accumulators that are
+    # snapshotted into a Commit_Metric whenever a refactoring commit is fed.
+    # The whole object is picklable so a later run can keep feeding new commits.
+    def __init__(self, index:Commit_Index = None):
+        self.index = index if index is not None else Commit_Index()
+        self.table = Commit_Table()
+        self.ordinal = 0
+        # Commit of the repository the state has reached, set by the caller before saving it
+        self.head = None
+
+        # Accumulated from the first commit up to the current one
+        self.files_history: Dict[str, File_History] = {}
+
+        # Window metrics look at commits since the previous refactoring commit (included)
+        self.window_start = 0
+
+    def run(self, commits, ref_commits = None, report:Run_Report = None):
+        # Without ref_commits the commits flagged is_refactor by the traversal are the refactoring ones
+        report = report or Run_Report()
+        ref_hashes = {c.hash for c in ref_commits} if ref_commits is not None else None
+        commits_list = []
+        ordinals = []
+        with report.stage('feed') as items:
+            first_ordinal = self.ordinal
+            for commit in commits:
+                ordinal = self.ordinal
+                is_refactor = commit.is_refactor if ref_hashes is None else commit.hash in ref_hashes
+                current_commit = self.feed(commit, is_refactor)
+                if current_commit is not None:
+                    commits_list.append(current_commit)
+                    ordinals.append(ordinal)
+            items['commits'] = self.ordinal - first_ordinal
+            items['refactoring_commits'] = len(commits_list)
+            items['file_metrics'] = sum(len(c.file_metrics) for c in commits_list)
+
+        # The experience metrics only depend on the commit table, answer them for all snapshots at once
+        with report.stage('experience') as items:
+            timeline = self.table.timeline()
+            exp, cexp, rexp = self.table.experience(ordinals)
+            file_ordinals = [ordinal for ordinal, c in zip(ordinals, commits_list) for _ in c.file_metrics]
+            oexp = timeline.oexp([m.high_contributer for c in commits_list for m in c.file_metrics], file_ordinals)
+            j = 0
+            for i, current_commit in enumerate(commits_list):
+                g_metric = current_commit.general_metric
+                g_metric.exp = round(float(exp[i]), 2)
+                g_metric.cexp = int(cexp[i])
+                g_metric.rexp = int(rexp[i])
+                for m_file in current_commit.file_metrics:
+                    m_file.oexp = round(float(oexp[j]), 2)
+                    j += 1
+                current_commit.add_metrics(current_commit.file_metrics)
+            items['table_rows'] = len(self.table)
+        return commits_list
+
+    def load_nloc(self, last_nloc):
+        # Fills the nloc of the last touch of each file when it was not loaded yet as it was fed
+        for name, nloc in last_nloc:
+            history = self.files_history.get(name)
+            if history is not None and history.nloc is None:
+                history.nloc = nloc
+
+    def feed(self, commit:F_Commit, is_refactor:bool):
+        ordinal = self.ordinal
+        index = self.index
+        if ordinal == len(index.authors):
+            index.add_commit(commit)
+        self.table.add_commit(commit)
+
+        author = commit.author
+        date = commit.date
+
+        files_dict = {file.name: file for file in commit.files}
+        for name, f_x in files_dict.items():
+            history = self.files_history.get(name)
+            if history is None:
+                history = self.files_history[name] = File_History(name)
+            history.touch(author, date, f_x.added_lines, f_x.deleted_lines, f_x.nloc)
+
+        current_commit = None
+        if is_refactor:
+            current_commit = self.snapshot(commit, files_dict, ordinal)
+            self.window_start = ordinal
+
+        self.ordinal += 1
+        return current_commit
+
+    def snapshot(self, commit:F_Commit, files_dict:dict, ordinal:int):
+        index = self.index
+        current_commit = Commit_Metric(commit.hash, commit.date, commit.msg)
+        g_metric = General_Metric()
+        g_metric.nf = commit.total_files
+        directory_list = set()
+        packages_list = set()
+
+        if re.search(FIX_PATTERN, commit.msg,  re.IGNORECASE):
+            g_metric.fix = True
+
+        files_per_commit: List[File_Metric] = []
+        for ref_file in commit.files:
+            if ref_file.pkg_name is not None:
+                packages_list.add(ref_file.pkg_name)
+
+            if ref_file.old_filepath:
+                directory_list.update(ref_file.old_filepath.split(os.sep)[:-1])
+
+            if ref_file.new_filepath:
+                directory_list.update(ref_file.new_filepath.split(os.sep)[:-1])
+
+            m_file = File_Metric(ref_file.name, ref_file.old_filepath, ref_file.new_filepath, ref_file.pkg_name)
+            if commit.total_lines > 0:
+                m_file.entropy = round((ref_file.added_lines + ref_file.deleted_lines) / commit.total_lines, 2)
+
+            window = index.file_commits(ref_file.name, self.window_start, ordinal)
+            m_file.comm_count = len(window)
+            m_file.ammount_adevs = {index.authors[x] for x in window}
+            m_file.adev_count = len(m_file.ammount_adevs)
+            m_file.ndev = m_file.adev_count
+
+            self.files_history[ref_file.name].fill_metric(m_file)
+            if ref_file.pkg_name is not None:
+                m_file.sexp = index.package_count(ref_file.pkg_name, commit.author, ordinal)
+            files_per_commit.append(m_file)
+
+        g_metric.nd = len(directory_list)
+        g_metric.ns = len(packages_list)
+
+        window = index.common_commits(files_dict.keys(), self.window_start, ordinal)
+        g_metric.ncomm = len(window)
+        g_metric.ammount_adevs = {index.authors[x] for x in window}
+        g_metric.nadev = len(g_metric.ammount_adevs)
+        g_metric.nddev = len(g_metric.ammount_adevs)
+        # EXP, CEXP and REXP are filled in by run() from the commit table
+
+        # Kept as File_Metric until run() fills in OEXP and calls add_metrics
+        current_commit.file_metrics = files_per_commit
+        current_commit.general_metric = g_metric
+        return current_commit
@@ -0,0 +1,130 @@
+import os
+import sqlite3
+import pandas as pd
+from contextlib import contextmanager
+
+STORE_FORMATS = ('sqlite', 'parquet')
+GENERAL_COLUMNS = ['NADEV', 'NDDEV', 'NCOMM', 'EXP', 'ND', 'NS', 'NF', 'FIX', 'CEXP', 'REXP']
+FILE_COLUMNS = ['new_path', 'old_path', 'filename', 'COMM', 'ADEV', 'DDEV', 'ADD', 'DEL', 'OWN', 'MINOR', 'OEXP',
+                'ENTROPY', 'LA', 'LD', 'NDEV', 'NUC', 'LT', 'AGE', 'SEXP']
+TABLES = {
+    'general_metrics': ['hash', 'commit_number', 'msg'] + GENERAL_COLUMNS,
+    'file_metrics': ['hash', 'commit_number'] + FILE_COLUMNS
+}
+SQL_TYPES = {'hash': 'TEXT', 'commit_number': 'INTEGER', 'msg': 'TEXT', 'new_path': 'TEXT', 'old_path': 'TEXT',
+             'filename': 'TEXT', 'EXP': 'REAL', 'ADD': 'REAL', 'DEL': 'REAL', 'OWN': 'REAL', 'OEXP': 'REAL',
+             'ENTROPY': 'REAL', 'AGE': 'REAL'}
+PANDAS_TYPES = {'TEXT': object, 'INTEGER': 'int64', 'REAL': 'float64'}
+
+@contextmanager
+def connect(db_path):
+    # sqlite3's own context manager commits but never closes
+    connection = sqlite3.connect(db_path)
+    try:
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+def write_sqlite_tables(connection, tables:dict):
+    """Creates the metrics tables if needed and appends the rows of flatten_metrics to them."""
+    for table, rows in tables.items():
+        columns = ', '.join(f'"{c}" {SQL_TYPES.get(c, "INTEGER")}' for c in TABLES[table])
+        connection.execute(f'CREATE TABLE IF NOT EXISTS {table} ({columns})')
+        connection.execute(f'CREATE INDEX IF NOT EXISTS {table}_hash ON {table} (hash)')
+        placeholders = ', '.join('?' * len(TABLES[table]))
+        connection.executemany(f'INSERT INTO {table} VALUES ({placeholders})', rows)
+    connection.execute('CREATE INDEX IF NOT EXISTS file_metrics_path ON file_metrics (new_path)')
+
+def flatten_metrics(entries, first_number = 1):
+    """Splits commit metric entries (as in metrics_*.json) into a general and a file metrics table.
+
+    commit_number is the position of the refactoring commit in date order, starting at first_number.
+    """
+    general_rows, file_rows = [], []
+    for number, entry in enumerate(entries, first_number):
+        general = entry['general_metrics']
+        general_rows.append((entry['refactor_hash'], number, entry['refactor_msg'], *(general[c] for c in GENERAL_COLUMNS)))
+        for file_metric in entry['file_metrics']:
+            file_rows.append((entry['refactor_hash'], number, *(file_metric[c] for c in FILE_COLUMNS)))
+    return general_rows, file_rows
+
+class Metrics_Store:
+    """Columnar copy of metrics_<repo>_output.json: one row per refactoring commit and one per file metric.
+
+    Both tables are keyed by the commit hash, so readers can load only the columns
+    they need. Stored as a SQLite database, or as two Parquet files (needs pyarrow).
+    """
+    def __init__(self, metrics_json_path:str, store_format:str = 'sqlite'):
+        if store_format not in STORE_FORMATS:
+            raise ValueError(f"Unknown metrics store format: {store_format}")
+        self.store_format = store_format
+        self.base_path = os.path.splitext(metrics_json_path)[0]
+
+    @classmethod
+    def find(cls, metrics_json_path:str):
+        """The store written next to metrics_json_path, or None."""
+        for store_format in STORE_FORMATS:
+            store = cls(metrics_json_path, store_format)
+            if store.exists():
+                return store
+        return None
+
+    def path(self, table:str = None):
+        if self.store_format == 'sqlite':
+            return self.base_path + '.sqlite'
+        return f'{self.base_path}.{table}.parquet'
+
+    def exists(self):
+        return all(os.path.exists(self.path(table)) for table in TABLES)
+
+    def count(self):
+        if not self.exists():
+            return 0
+        if self.store_format == 'sqlite':
+            with connect(self.path()) as connection:
+                return connection.execute('SELECT COUNT(*) FROM general_metrics').fetchone()[0]
+        return len(pd.read_parquet(self.path('general_metrics'), columns=['hash']))
+
+    def hashes(self):
+        """Hashes of the commits already stored."""
+        if not self.exists():
+            return set()
+        return set(self.read('general_metrics', ['hash'])['hash'])
+
+    def write(self, entries, append:bool = False):
+        """Writes the commit metric entries, after the ones already stored when append is set."""
+        first_number = self.count() + 1 if append else 1
+        tables = dict(zip(TABLES, flatten_metrics(entries, first_number)))
+        if self.store_format == 'sqlite':
+            self.write_sqlite(tables, append)
+        else:
+            self.write_parquet(tables, append)
+        return self.path('general_metrics')
+
+    def write_sqlite(self, tables:dict, append:bool):
+        if not append and os.path.exists(self.path()):
+            os.remove(self.path())
+        with connect(self.path()) as connection:
+            write_sqlite_tables(connection, tables)
+
+    def write_parquet(self, tables:dict, append:bool):
+        for table, rows in tables.items():
+            path = self.path(table)
+            # A column of ratios that are all 0 would otherwise be stored as integers
+            frame = pd.DataFrame(rows, columns=TABLES[table]).astype(
+                {c: PANDAS_TYPES[SQL_TYPES.get(c, 'INTEGER')] for c in TABLES[table]})
+            if append and os.path.exists(path):
+                frame = pd.concat([pd.read_parquet(path), frame], ignore_index=True)
+            tmp_path = path + '.tmp'
+            frame.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, path)
+
+    def read(self, table:str, columns = None):
+        """Loads a table, or only the given columns of it, as a DataFrame."""
+        columns = list(columns) if columns else TABLES[table]
+        if self.store_format == 'parquet':
+            return pd.read_parquet(self.path(table), columns=columns)
+        with connect(self.path()) as connection:
+            selected = ', '.join(f'"{c}"' for c in columns)
+            return pd.read_sql_query(f'SELECT {selected} FROM {table} ORDER BY rowid', connection)
@@ -0,0 +1,281 @@
+import os
+import json
+import asyncio
+import time
+import shutil
+import hashlib
+import subprocess
+from contextlib import contextmanager
+
+DEFAULT_STORE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'repo_mirrors')
+# A lock older than this is left over by a crashed process
+STALE_LOCK_SECONDS = 6 * 60 * 60
+SIZE_UNITS = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+def parse_size(size):
+    """Parses a disk quota such as 500M or 20G into bytes, None means unbounded."""
+    if size is None or isinstance(size, int):
+        return size
+    size = size.strip().upper().rstrip('B')
+    if size and size[-1] in SIZE_UNITS:
+        return int(float(size[:-1]) * SIZE_UNITS[size[-1]])
+    return int(size)
+
+def normalize_url(url):
+    # https://github.com/a/b, https://github.com/a/b.git and .../b/ are the same repository
+    url = url.strip().rstrip('/')
+    if url.endswith('.git'):
+        url = url[:-4]
+    scheme, sep, rest = url.partition('://')
+    if sep:
+        host, _, path = rest.partition('/')
+        return f'{scheme.lower()}://{host.lower()}/{path}'
+    return url
+
+def get_directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def get_checkout_marker(mirror_path, dest):
+    # One file per checkout of the mirror, named after its absolute path
+    return os.path.join(mirror_path, 'checkouts', hashlib.sha1(dest.encode('utf-8')).hexdigest())
+
+def get_checkouts(mirror_path):
+    """The checkouts of the mirror still on disk."""
+    checkouts_dir = os.path.join(mirror_path, 'checkouts')
+    if not os.path.isdir(checkouts_dir):
+        return []
+    checkouts = []
+    for name in os.listdir(checkouts_dir):
+        try:
+            with open(os.path.join(checkouts_dir, name), 'r', encoding='utf-8') as f:
+                dest = f.read()
+        except OSError:
+            continue
+        # Left over by a process that crashed before releasing its checkout
+        if os.path.exists(dest):
+            checkouts.append(dest)
+    return checkouts
+
+def get_shared_mirror(dest):
+    """The mirror whose objects the checkout at dest borrows, or None."""
+    alternates_path = os.path.join(dest, '.git', 'objects', 'info', 'alternates')
+    if not os.path.isfile(alternates_path):
+        return None
+    with open(alternates_path, 'r', encoding='utf-8') as f:
+        objects_dir = f.readline().strip()
+    return os.path.dirname(objects_dir) if objects_dir else None
+
+@contextmanager
+def file_lock(lock_path, poll = 0.2):
+    """Cross-process lock held by the creation of lock_path."""
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) > STALE_LOCK_SECONDS:
+                    os.remove(lock_path)
+                    continue
+            except OSError:
+                continue
+            time.sleep(poll)
+    try:
+        os.write(fd, str(os.getpid()).encode())
+        yield
+    finally:
+        os.close(fd)
+        os.remove(lock_path)
+
+class Mirror_Store:
+    """Bare mirrors of remote repositories shared by every tool of the project.
+
+    Each repository is mirrored once under <root>/<key[:2]>/<key>.git, where key is
+    the sha1 of its normalized URL, and later runs only fetch the new objects.
+    Working trees are `git clone --shared` checkouts of the mirror made on demand,
+    which borrow its objects and track its branches as refs/remotes/origin/*. When
+    the mirrors outgrow the disk quota the least recently used ones are evicted.
+    """
+    def __init__(self, root:str = None, quota = None):
+        self.root = root or os.environ.get('MIRROR_STORE_DIR') or DEFAULT_STORE_DIR
+        self.quota = parse_size(quota if quota is not None else os.environ.get('MIRROR_STORE_QUOTA'))
+        self.index_path = os.path.join(self.root, 'index.json')
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def key(url:str) -> str:
+        return hashlib.sha1(normalize_url(url).encode('utf-8')).hexdigest()
+
+    def mirror_path(self, url:str) -> str:
+        key = self.key(url)
+        return os.path.join(self.root, key[:2], f'{key}.git')
+
+    def fetch_command(self, url:str, options = ()):
+        """The git command that creates or refreshes the mirror of url.
+
+        options are extra `git clone` options such as --depth or --filter=blob:none.
+        """
+        mirror_path = self.mirror_path(url)
+        if os.path.exists(os.path.join(mirror_path, 'HEAD')):
+            if not options and os.path.exists(os.path.join(mirror_path, 'shallow')):
+                # Made by a shallow clone but the whole history is wanted now
+                return ['git', '-C', mirror_path, 'fetch', '--unshallow', '--prune', 'origin']
+            return ['git', '-C', mirror_path, 'fetch', '--prune', 'origin']
+        return ['git', 'clone', '--mirror', *options, url, mirror_path]
+
+    @contextmanager
+    def locked(self, url:str):
+        mirror_path = self.mirror_path(url)
+        os.makedirs(os.path.dirname(mirror_path), exist_ok=True)
+        with file_lock(mirror_path + '.lock'):
+            yield mirror_path
+
+    def fetch(self, url:str, options = (), env = None) -> str:
+        """Creates or refreshes the mirror of url and returns its path."""
+        with self.locked(url) as mirror_path:
+            command = self.fetch_command(url, options)
+            try:
+                subprocess.run(command, check=True, env=env)
+            except subprocess.CalledProcessError:
+                if command[1] == 'clone':
+                    # Never leave a half cloned mirror behind
+                    shutil.rmtree(mirror_path, ignore_errors=True)
+                raise
+        self.record(url)
+        return mirror_path
+
+    async def fetch_async(self, url:str, options = (), env = None) -> str:
+        """Same as fetch, running git as an asyncio subprocess."""
+        loop = asyncio.get_running_loop()
+        lock = self.locked(url)
+        # Waiting for another process to release the mirror must not block the event loop
+        mirror_path = await loop.run_in_executor(None, lock.__enter__)
+        try:
+            command = self.fetch_command(url, options)
+            process = await asyncio.create_subprocess_exec(*command, env=env)
+            if await process.wait() != 0:
+                if command[1] == 'clone':
+                    shutil.rmtree(mirror_path, ignore_errors=True)
+                raise subprocess.CalledProcessError(process.returncode, command)
+        finally:
+            lock.__exit__(None, None, None)
+        await loop.run_in_executor(None, self.record, url)
+        return mirror_path
+
+    def record(self, url:str):
+        """Updates the size and last use of the mirror of url, then enforces the quota."""
+        with file_lock(self.index_path + '.lock'):
+            index = self.load_index()
+            index[self.key(url)] = {
+                'url': normalize_url(url),
+                'path': self.mirror_path(url),
+                'size': get_directory_size(self.mirror_path(url)),
+                'last_used': time.time()
+            }
+            self.evict(index, keep=self.key(url))
+            self.save_index(index)
+
+    def evict(self, index:dict, keep:str = None):
+        if self.quota is None:
+            return
+        total = sum(entry['size'] for entry in index.values())
+        for key, entry in sorted(index.items(), key=lambda item: item[1]['last_used']):
+            if total <= self.quota:
+                break
+            if key == keep or self.in_use(entry['path']):
+                continue
+            print(f"Evicting the mirror of {entry['url']} ({entry['size'] >> 20} MB)")
+            shutil.rmtree(entry['path'], ignore_errors=True)
+            total -= entry['size']
+            del index[key]
+
+    @staticmethod
+    def in_use(mirror_path:str) -> bool:
+        # Being fetched, checked out, or checked out in a worktree
+        worktrees = os.path.join(mirror_path, 'worktrees')
+        return (os.path.exists(mirror_path + '.lock') or bool(get_checkouts(mirror_path))
+                or (os.path.isdir(worktrees) and bool(os.listdir(worktrees))))
+
+    def load_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def save_index(self, index:dict):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, indent=4)
+        os.replace(tmp_path, self.index_path)
+
+    def checkout(self, url:str, dest:str, rev:str = 'HEAD') -> str:
+        """Checks out rev of the (already fetched) mirror of url as a shared clone at dest.
+
+        A worktree of the mirror would only have its refs/heads/*, while RefactoringMiner's
+        -a mode walks the refs/remotes/origin/* branches of a clone.
+        """
+        if os.path.exists(dest):
+            print(f"The checkout {dest} already exists. Reusing it.")
+            return dest
+        dest = os.path.abspath(dest)
+        with self.locked(url) as mirror_path:
+            mirror_path = os.path.abspath(mirror_path)
+            # Marked before cloning so the mirror is never evicted under a checkout
+            marker_path = get_checkout_marker(mirror_path, dest)
+            os.makedirs(os.path.dirname(marker_path), exist_ok=True)
+            with open(marker_path, 'w', encoding='utf-8') as f:
+                f.write(dest)
+            try:
+                # Resolved against the mirror's refs, which are branches of the remote in the clone
+                commit = subprocess.run(['git', '-C', mirror_path, 'rev-parse', '--verify', f'{rev}^{{commit}}'],
+                                        check=True, capture_output=True, text=True).stdout.strip()
+                subprocess.run(['git', 'clone', '--shared', '--no-checkout', mirror_path, dest], check=True)
+                promisor = subprocess.run(['git', '-C', mirror_path, 'config', '--get', 'remote.origin.promisor'],
+                                          capture_output=True, text=True).stdout.strip()
+                if promisor == 'true':
+                    # The blobs a blobless mirror lacks are fetched from the remote itself
+                    subprocess.run(['git', '-C', dest, 'config', 'remote.origin.url', url], check=True)
+                    subprocess.run(['git', '-C', dest, 'config', 'remote.origin.promisor', 'true'], check=True)
+                    subprocess.run(['git', '-C', dest, 'config', 'remote.origin.partialclonefilter', 'blob:none'], check=True)
+                subprocess.run(['git', '-C', dest, 'checkout', '--detach', commit], check=True)
+            except subprocess.CalledProcessError:
+                shutil.rmtree(dest, ignore_errors=True)
+                os.remove(marker_path)
+                raise
+        return dest
+
+    def release(self, dest:str):
+        """Removes a checkout made by checkout, or a worktree; the mirror stays in the store."""
+        if not os.path.exists(dest):
+            return
+        mirror_path = get_shared_mirror(dest)
+        if mirror_path:
+            shutil.rmtree(dest, ignore_errors=True)
+            marker_path = get_checkout_marker(mirror_path, os.path.abspath(dest))
+            if os.path.exists(marker_path) and not os.path.exists(dest):
+                os.remove(marker_path)
+            return
+        result = subprocess.run(['git', '-C', dest, 'rev-parse', '--git-common-dir'], capture_output=True, text=True)
+        common_dir = os.path.abspath(os.path.join(dest, result.stdout.strip())) if result.returncode == 0 else None
+        if common_dir and os.path.isfile(os.path.join(dest, '.git')):
+            removed = subprocess.run(['git', '-C', common_dir, 'worktree', 'remove', '--force', os.path.abspath(dest)])
+            if removed.returncode == 0:
+                return
+        shutil.rmtree(dest, ignore_errors=True)
+        if common_dir:
+            subprocess.run(['git', '-C', common_dir, 'worktree', 'prune'])
+
+    @contextmanager
+    def worktree(self, url:str, dest:str, rev:str = 'HEAD'):
+        self.fetch(url)
+        try:
+            yield self.checkout(url, dest, rev)
+        finally:
+            self.release(dest)
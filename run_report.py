@@ -0,0 +1,180 @@
+import os
+import sys
+import json
+import time
+import cProfile
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:
+    # Windows, CPU time of subprocesses and peak RSS are not reported
+    resource = None
+
+PROFILERS = ('cprofile', 'pyinstrument')
+
+def get_peak_rss_mb():
+    """Peak resident memory of this process, since the last reset_peak_rss when the kernel supports it."""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+def reset_peak_rss():
+    # Linux only: makes VmHWM start again from the current RSS
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+def get_children_usage():
+    """CPU seconds and peak RSS (MB) of the finished subprocesses (git, RefactoringMiner...)."""
+    if resource is None:
+        return 0.0, None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    peak = usage.ru_maxrss / (1 << 20) if sys.platform == 'darwin' else usage.ru_maxrss / 1024
+    return usage.ru_utime + usage.ru_stime, peak
+
+class Run_Report:
+    """Wall time, CPU time, peak RSS and item counts of each stage of one run of the pipeline.
+
+    Each run is appended as one JSON line to outputs/<repo>/run_report.jsonl. Without
+    a folder the stages are still measured but nothing is saved. Nested stages are
+    named <stage>.<step>, e.g. metrics.feed. Peak RSS is the peak of the stage when
+    the kernel lets it be reset (Linux), otherwise the peak of the process so far.
+
+    profile='cprofile' (or 'pyinstrument', if installed) also profiles the whole run
+    into profile_<started_at>.prof (or .html) next to the report.
+    """
+    def __init__(self, repo_output_dir:str = None, command:str = None, profile:str = None):
+        if profile is not None and profile not in PROFILERS:
+            raise ValueError(f"Unknown profiler: {profile}")
+        self.path = os.path.join(repo_output_dir, 'run_report.jsonl') if repo_output_dir else None
+        self.command = command
+        self.profile = profile
+        self.stages = []
+        self.open_stages = []
+        self.started_at = None
+        self.started = None
+        self.depth = 0
+        self.profiler = None
+
+    def __enter__(self):
+        # Re-entered when update_repo falls back to analyze_repo, only the outer run is saved
+        self.depth += 1
+        if self.depth == 1:
+            self.started_at = datetime.now(timezone.utc)
+            self.started = time.perf_counter()
+            self.start_profiler()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.depth -= 1
+        if self.depth == 0:
+            self.stop_profiler()
+            self.save('failed' if exc_type is not None else 'done')
+        return False
+
+    def record_peak(self, records):
+        # A nested stage resets the peak, so the stages around it keep the highest value seen
+        peak = get_peak_rss_mb()
+        if peak is not None:
+            for record in records:
+                record['peak_rss_mb'] = max(record['peak_rss_mb'] or 0, peak)
+
+    @contextmanager
+    def stage(self, name:str):
+        """Measures the block; the yielded dict takes item counts, e.g. items['commits'] = n."""
+        self.record_peak(self.open_stages)
+        reset_peak_rss()
+
+        prefix = self.open_stages[-1]['stage'] + '.' if self.open_stages else ''
+        record = {'stage': prefix + name, 'status': 'done', 'peak_rss_mb': None}
+        items = {}
+        children_cpu, _ = get_children_usage()
+        wall, cpu = time.perf_counter(), time.process_time()
+        # Nested stages are saved before the stage around them, start_s gives the actual order
+        record['start_s'] = round(wall - self.started, 3) if self.started is not None else None
+        self.open_stages.append(record)
+        try:
+            yield items
+        except BaseException:
+            record['status'] = 'failed'
+            raise
+        finally:
+            self.open_stages.pop()
+            end_children_cpu, children_peak = get_children_usage()
+            record['wall_s'] = round(time.perf_counter() - wall, 3)
+            record['cpu_s'] = round(time.process_time() - cpu, 3)
+            record['children_cpu_s'] = round(end_children_cpu - children_cpu, 3)
+            self.record_peak([record] + self.open_stages)
+            if record['peak_rss_mb'] is not None:
+                record['peak_rss_mb'] = round(record['peak_rss_mb'], 1)
+            record['children_peak_rss_mb'] = round(children_peak, 1) if children_peak is not None else None
+            record['items'] = items
+            self.stages.append(record)
+
+    def skip(self, name:str, reason:str = 'cached'):
+        """Records a stage that did not run, e.g. because the manifest had it done already."""
+        self.stages.append({'stage': name, 'status': reason})
+
+    def start_profiler(self):
+        if self.profile == 'cprofile':
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        elif self.profile == 'pyinstrument':
+            from pyinstrument import Profiler
+            self.profiler = Profiler()
+            self.profiler.start()
+
+    def stop_profiler(self):
+        if self.profiler is None:
+            return
+        stamp = self.started_at.strftime('%Y%m%dT%H%M%S')
+        directory = os.path.dirname(self.path) if self.path else os.getcwd()
+        os.makedirs(directory, exist_ok=True)
+        if self.profile == 'cprofile':
+            self.profiler.disable()
+            profile_path = os.path.join(directory, f'profile_{stamp}.prof')
+            # Open with python -m pstats or snakeviz
+            self.profiler.dump_stats(profile_path)
+        else:
+            self.profiler.stop()
+            profile_path = os.path.join(directory, f'profile_{stamp}.html')
+            with open(profile_path, 'w', encoding='utf-8') as f:
+                f.write(self.profiler.output_html())
+        self.profiler = None
+        print(f"Profile saved to {profile_path}")
+
+    def to_dict(self, status:str):
+        return {
+            'command': self.command,
+            'status': status,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'wall_s': round(time.perf_counter() - self.started, 3) if self.started is not None else None,
+            'pid': os.getpid(),
+            'stages': self.stages
+        }
+
+    def save(self, status:str = 'done'):
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(self.to_dict(status), separators=(',', ':')))
+            f.write('\n')
+        print(f"Run report saved to {self.path}")
+        for record in self.stages:
+            if 'wall_s' in record:
+                print(f"  {record['stage']:<28} {record['wall_s']:>9.2f}s wall {record['cpu_s']:>9.2f}s cpu "
+                      f"{record['peak_rss_mb'] or 0:>8.1f} MB")